@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""Benchmark httpserver with a local load generator
+
+Run as ``python -m benchmarks.bench``.
+
+Usage:
+    bench [options] [<scenario>...]
+
+Options::
+
+    -c,--connections=<n>    Number of keep-alive connections (default 16)
+    -t,--duration=<s>       Seconds to run each scenario (default 5)
+    -w,--workers=<n>        Number of server worker processes (default 1)
+    --loop=<loop>           Event loop of the server: auto, asyncio or
+                            uvloop (default auto)
+    -o,--output=<file>      Write the JSON results to this file
+    --help                  Print this help message
+
+Scenarios: small, large, not_modified, not_found, pipelined (default: all)
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import textwrap
+import time
+
+import httpserver
+from httpserver import _start_server
+from httpserver.loops import LOOPS, resolve
+
+HOST = 'localhost'
+
+#: Size of the files that are served
+SMALL_SIZE = 1024
+LARGE_SIZE = 8 * 1024 * 1024
+
+#: Number of requests sent at once in the pipelined scenario
+PIPELINE_DEPTH = 8
+
+
+def _request(path, *headers):
+    """Build a request for path"""
+    lines = ['GET {} HTTP/1.1'.format(path), 'Host: ' + HOST]
+    lines.extend(headers)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+
+def _percentile(values, percentage):
+    """Get a percentile of sorted values
+
+    >>> _percentile([1, 2, 3, 4], 50)
+    2
+    """
+    if not values:
+        return None
+    index = max(0, int(round(len(values) * percentage / 100)) - 1)
+    return values[index]
+
+
+async def _read_response(reader):
+    """Read a response, returns the status code and the number of bytes"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':', 1)[1])
+    await reader.readexactly(length)
+    return int(head.split(b' ', 2)[1]), len(head) + length
+
+
+async def _client(port, request, depth, deadline, result):
+    """Send requests over one connection until the deadline passes"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            writer.write(request * depth)
+            for _ in range(depth):
+                status, size = await _read_response(reader)
+                result['latencies'].append(time.monotonic() - start)
+                result['bytes'] += size
+                if status >= 500:
+                    result['errors'] += 1
+    finally:
+        writer.close()
+
+
+async def _get_etag(port, path):
+    """Get the ETag of a file"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(_request(path))
+    head = await reader.readuntil(b'\r\n\r\n')
+    writer.close()
+    for line in head.decode().split('\r\n'):
+        if line.lower().startswith('etag:'):
+            return line.split(':', 1)[1].strip()
+
+
+async def _scenario_requests(port, name):
+    """Get the request and pipeline depth for a scenario"""
+    if name == 'small':
+        return _request('/small.html'), 1
+    if name == 'large':
+        return _request('/large.bin'), 1
+    if name == 'not_modified':
+        etag = await _get_etag(port, '/small.html')
+        return _request('/small.html', 'If-None-Match: ' + etag), 1
+    if name == 'not_found':
+        return _request('/does_not_exist'), 1
+    if name == 'pipelined':
+        return _request('/small.html'), PIPELINE_DEPTH
+    raise ValueError('Unknown scenario {}'.format(name))
+
+
+#: All scenarios in the order they are run
+SCENARIOS = ('small', 'large', 'not_modified', 'not_found', 'pipelined')
+
+
+async def run_scenario(port, name, connections, duration):
+    """Run a scenario and return its results"""
+    request, depth = await _scenario_requests(port, name)
+    result = {'latencies': [], 'bytes': 0, 'errors': 0}
+    start = time.monotonic()
+    await asyncio.gather(*[
+        _client(port, request, depth, start + duration, result)
+        for _ in range(connections)])
+    elapsed = time.monotonic() - start
+
+    latencies = sorted(result['latencies'])
+    milliseconds = {
+        'p{}'.format(p): round(_percentile(latencies, p) * 1000, 3)
+        for p in (50, 95, 99)
+    } if latencies else {}
+    return {
+        'scenario': name,
+        'connections': connections,
+        'requests': len(latencies),
+        'errors': result['errors'],
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'bytes_per_second': round(result['bytes'] / elapsed, 1),
+        'latency_ms': milliseconds,
+    }
+
+
+def _create_files(folder):
+    """Create the files that are served"""
+    with open(os.path.join(folder, 'small.html'), 'wb') as f:
+        f.write(b'x' * SMALL_SIZE)
+    with open(os.path.join(folder, 'large.bin'), 'wb') as f:
+        f.write(os.urandom(LARGE_SIZE))
+
+
+def _serve(*args, **kwargs):
+    """Run the server without printing to stdout"""
+    sys.stdout = open(os.devnull, 'w')
+    _start_server(*args, **kwargs)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_for_server(port, timeout=10):
+    """Wait until the server accepts connections"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            return
+
+
+def run_benchmarks(scenarios=SCENARIOS, connections=16, duration=5,
+                   workers=1, loop_name='auto'):
+    """Start a server and run the scenarios against it
+
+    The load generator always uses the asyncio loop, so only the event loop
+    of the server differs between runs with a different ``loop_name``.
+    """
+    folder = tempfile.mkdtemp()
+    _create_files(folder)
+    port = _free_port()
+    server = multiprocessing.Process(
+        target=_serve,
+        args=('127.0.0.1', port, HOST, folder),
+        kwargs={'workers': workers, 'loop_name': loop_name})
+    server.start()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_wait_for_server(port))
+        results = [loop.run_until_complete(
+                       run_scenario(port, name, connections, duration))
+                   for name in scenarios]
+    finally:
+        loop.close()
+        server.terminate()
+        server.join()
+        shutil.rmtree(folder)
+
+    return {
+        'version': httpserver.__version__,
+        'python': sys.version.split()[0],
+        'workers': workers,
+        'loop': resolve(loop_name),
+        'duration': duration,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results,
+    }
+
+
+def main(argv=None):  # pragma: no cover
+    import docopt
+    docblock = __doc__.replace('::', ':')
+    args = docopt.docopt(textwrap.dedent(docblock), argv)
+    scenarios = args['<scenario>'] or SCENARIOS
+    for name in scenarios:
+        if name not in SCENARIOS:
+            sys.exit('Unknown scenario {}'.format(name))
+    loop_name = args['--loop'] or 'auto'
+    if loop_name not in LOOPS:
+        sys.exit('Unknown event loop {}'.format(loop_name))
+
+    report = run_benchmarks(scenarios,
+                            connections=int(args['--connections'] or 16),
+                            duration=float(args['--duration'] or 5),
+                            workers=int(args['--workers'] or 1),
+                            loop_name=loop_name)
+    output = json.dumps(report, indent=2)
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
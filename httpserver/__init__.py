@@ -8,34 +8,309 @@ __email__ = 'thom@thomwiggers.nl, info@luukscholten.com'
 __version__ = '1.1.0'
 
 
-def _start_server(bindaddr, port, hostname, folder):
-    """Starts an asyncio server"""
+def _start_server(bindaddr, port, hostname, folder, cache_size=64,
+                  cache_check=0, etag='stat', workers=1, compress_size=1024,
+                  threads=4, high_water=None, low_water=None, index=None,
+                  mmap_size=0, metrics_path=None, access_log=None,
+                  access_log_format='common', access_log_size=0,
+                  max_connections=0, when_full='reject', drain_timeout=10,
+                  loop_name='auto', vhosts=(), default_host=None,
+                  warm=False, manifest_file=None, warm_processes=0,
+                  certfile=None, keyfile=None, sni_certs=()):
+    """Starts an asyncio server
+
+    The file caches hold at most ``cache_size`` MiB together, a quarter of
+    which is for compressed versions of files. They check files on disk
+    at most every ``cache_check`` milliseconds. ``etag`` selects how ETags
+    are generated. Files up to ``compress_size`` KiB are compressed on the
+    fly. Files that aren't cached in memory are read from a pool of
+    ``threads`` threads, or from the event loop if ``threads`` is 0.
+    Writing a response pauses when more than ``high_water`` KiB are buffered
+    for a connection and resumes below ``low_water`` KiB. If ``index`` is
+    set, the folder is indexed at startup and every ``index`` seconds after
+    that, or never again if it is 0, and only indexed files are served.
+    Up to ``mmap_size`` MiB of large files are kept memory-mapped. If
+    ``metrics_path`` is set, the metrics of a worker are served there.
+    Every response is logged to the ``access_log`` file, ``-`` for stdout,
+    in ``access_log_format``. The file is rotated when it grows beyond
+    ``access_log_size`` MiB. A worker serves at most ``max_connections``
+    connections at once, 0 for no limit, and then rejects new connections
+    or lets them wait, depending on ``when_full``. On ``SIGTERM`` the server
+    stops accepting connections and waits up to ``drain_timeout`` seconds
+    for the requests it received to be answered. ``loop_name`` selects the
+    event loop, see :data:`httpserver.loops.LOOPS`.
+
+    Besides ``hostname``, the ``(name, folder)`` pairs in ``vhosts`` are
+    served, where a name may be a wildcard like ``*.example.com``. Requests
+    for other hosts are served from the site named ``default_host``, if set,
+    or get a 404.
+
+    If ``warm`` is set, the folders are scanned at startup and the caches
+    are filled before connections are accepted. The ETags and content types
+    that were found are saved to ``manifest_file``, if set, so the next
+    startup only hashes the files that changed. Files are hashed in a pool
+    of ``warm_processes`` processes, or in this process if it is 0.
+
+    If ``certfile`` is set, connections use TLS with the certificate in
+    ``certfile`` and the private key in ``keyfile``, or in ``certfile`` if
+    it isn't set. The ``(name, certfile, keyfile)`` triples in ``sni_certs``
+    are used for clients that ask for such a server name. The contexts are
+    created before the workers are forked, so a client can resume its TLS
+    session with any worker.
+
+    If ``workers`` is more than one, that many worker processes are forked.
+    They each bind to the port with ``SO_REUSEPORT`` if the platform supports
+    it, otherwise they share a listening socket. On ``SIGHUP`` a new
+    generation of workers is started, and the old one is drained once the
+    new workers listen.
+    """
+    import functools
+    import socket
+    manifest = None
+    if warm or manifest_file:
+        manifest = _scan(etag, [folder] + [root for _, root in vhosts],
+                         manifest_file, warm_processes)
+    certificates = None
+    if certfile:
+        from .tls import Certificates
+        certificates = Certificates(certfile, keyfile)
+        for name, name_certfile, name_keyfile in sni_certs:
+            certificates.add(name, name_certfile, name_keyfile)
+    elif sni_certs:
+        raise ValueError('SNI certificates need a default certificate')
+    serve = functools.partial(_serve, hostname, folder, cache_size,
+                              cache_check, etag, compress_size, threads,
+                              high_water, low_water, index, mmap_size,
+                              metrics_path, access_log, access_log_format,
+                              access_log_size, max_connections, when_full,
+                              drain_timeout, loop_name, vhosts,
+                              default_host, manifest, certificates)
+    if workers <= 1:
+        serve(host=bindaddr, port=port)
+        return
+
+    from .workers import Supervisor, listen
+    if hasattr(socket, 'SO_REUSEPORT'):
+        target = functools.partial(serve, host=bindaddr, port=port,
+                                   reuse_port=True)
+    else:  # pragma: no cover
+        target = functools.partial(serve, sock=listen(bindaddr, port))
+
+    print('Starting {} workers on {}:{}'.format(workers, bindaddr, port))
+    if not Supervisor(workers, target).run():
+        raise SystemExit(1)
+
+
+def _scan(etag, folders, manifest_file=None, processes=0):
+    """Build the manifest of folders, reusing the one in manifest_file"""
+    from concurrent.futures import ProcessPoolExecutor
+    from .manifest import Manifest
+    previous = None
+    if manifest_file:
+        previous = Manifest.load(manifest_file, etag)
+    manifest = Manifest(etag)
+    executor = ProcessPoolExecutor(processes) if processes > 0 else None
+    try:
+        manifest.scan(folders, previous, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if manifest_file:
+        try:
+            manifest.save(manifest_file)
+        except OSError as e:
+            logging.getLogger(__name__).warning(
+                'Could not save manifest %s: %s', manifest_file, e)
+    return manifest
+
+
+def _serve(hostname, folder, cache_size, cache_check, etag, compress_size,
+           threads, high_water, low_water, index, mmap_size, metrics_path,
+           access_log, access_log_format, access_log_size, max_connections,
+           when_full, drain_timeout, loop_name, vhosts, default_host,
+           manifest=None, certificates=None, ready=None, **kwargs):
+    """Run an asyncio server in this process
+
+    ``ready`` is called once the server accepts connections. ``kwargs`` are
+    passed to ``loop.create_server``.
+    """
     import asyncio
+    import os
+    import signal
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    from .accesslog import AccessLog
+    from .cache import FileCache
+    from .connections import ConnectionManager
     from .httpserver import HttpProtocol
+    from .index import PathIndex
+    from .loops import install
+    from .metrics import Metrics
+    from .vhosts import HostTable, VirtualHost
+    loop_name = install(loop_name)
     loop = asyncio.get_event_loop()
-    coroutine = loop.create_server(lambda: HttpProtocol(hostname, folder),
-                                   bindaddr,
-                                   port)
+    # Compressed versions get a quarter of the cache
+    cache_size *= 1024 * 1024
+    cache = FileCache(max_size=cache_size - cache_size // 4,
+                      check_interval=cache_check / 1000)
+    compressed_cache = FileCache(max_size=cache_size // 4,
+                                 check_interval=cache_check / 1000)
+    mmap_cache = None
+    if mmap_size > 0:
+        mmap_cache = FileCache(max_size=mmap_size * 1024 * 1024,
+                               check_interval=cache_check / 1000)
+    metrics = Metrics()
+    connections = ConnectionManager(loop, max_connections, when_full)
+    log = None
+    if access_log:
+        log = AccessLog(access_log, access_log_format,
+                        max_size=access_log_size * 1024 * 1024)
+        log.start()
+    executor = ThreadPoolExecutor(threads) if threads > 0 else None
+    # One table of sites, shared by all connections
+    hosts = HostTable()
+    for name, root in [(hostname, folder)] + list(vhosts):
+        path_index = None
+        if index is not None:
+            path_index = PathIndex(root)
+            path_index.scan()
+            if index > 0:
+                path_index.rescan_every(loop, index, executor)
+        hosts.add(name, VirtualHost(root, path_index))
+    if default_host is not None:
+        hosts.default = hosts.get(default_host)
+        if hosts.default is None:
+            raise ValueError('Unknown default host {}'.format(default_host))
+    if manifest is not None:
+        # Every worker fills its own caches before it accepts connections
+        loaded = HttpProtocol(
+            hostname, folder, event_loop=loop, cache=cache, etag=etag,
+            compressed_cache=compressed_cache,
+            compress_max_size=compress_size * 1024, hosts=hosts,
+            mmap_cache=mmap_cache, manifest=manifest).warm()
+        logging.getLogger(__name__).info(
+            'Loaded %d of %d files into the cache', loaded, len(manifest))
+    if certificates is not None:
+        kwargs['ssl'] = certificates.context
+    coroutine = loop.create_server(
+        lambda: HttpProtocol(hostname, folder, cache=cache, etag=etag,
+                             compressed_cache=compressed_cache,
+                             compress_max_size=compress_size * 1024,
+                             executor=executor,
+                             high_water=_kib(high_water),
+                             low_water=_kib(low_water),
+                             hosts=hosts, mmap_cache=mmap_cache,
+                             metrics=metrics, metrics_path=metrics_path,
+                             access_log=log, connections=connections,
+                             manifest=manifest, certificates=certificates),
+        **kwargs)
     server = loop.run_until_complete(coroutine)
 
-    print('Starting server on {}'.format(server.sockets[0].getsockname()))
+    # A single write, so lines of several workers don't get mixed up
+    sys.stdout.write('Starting server on {} with {} (pid {})\n'.format(
+        server.sockets[0].getsockname(), loop_name, os.getpid()))
+    sys.stdout.flush()
+    if ready is not None:
+        ready()
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
     try:
         loop.run_forever()
+        # Stopped by SIGTERM: let the connections finish what they started
+        server.close()
+        aborted = loop.run_until_complete(
+            connections.drain(drain_timeout))
+        if aborted:
+            logging.getLogger(__name__).warning(
+                'Aborted %d connections after draining', aborted)
     except KeyboardInterrupt:
         pass
+    finally:
+        if log is not None:
+            log.close()
+
+
+def _kib(size):
+    """Convert an optional size in KiB to bytes"""
+    return size * 1024 if size is not None else None
 
 
 def run(argv=None):  # pragma: no cover
     """Run the HTTP server
 
     Usage:
-        httpserver [options] [<folder>]
+        httpserver [options] [--vhost=<name=folder>...]
+                   [--sni-cert=<name=certfile>...] [<folder>]
 
     Options::
 
         -h,--host=<hostname>        What host name to serve (default localhost)
         -a,--bindaddress=<address>  Address to bind to (default 127.0.0.1)
         -p,--port=<port>            Port to listen on (default 8080)
+        --cache-size=<MiB>          Size of the file caches, including
+                                    compressed files (default 64)
+        --cache-check=<ms>          Only check cached files on disk every
+                                    <ms> milliseconds (default 0)
+        --compress-size=<KiB>       Compress files up to this size on the
+                                    fly, 0 disables this (default 1024)
+        -w,--workers=<n>            Number of worker processes (default 1)
+        --threads=<n>               Number of threads per worker that read
+                                    files which aren't cached, 0 reads them
+                                    from the event loop (default 4)
+        --high-water=<KiB>          Pause writing to a connection when more
+                                    than this is buffered (default 64)
+        --low-water=<KiB>           Resume writing when less than this is
+                                    buffered (default a quarter of
+                                    --high-water)
+        --index=<s>                 Only serve files found by indexing the
+                                    folder at startup, and index it again
+                                    every <s> seconds, 0 never does
+        --mmap-size=<MiB>           Keep up to this much of large files
+                                    memory-mapped, 0 disables this
+                                    (default 0)
+        --metrics-path=<path>       Serve metrics in the Prometheus text
+                                    format at this path, eg. /__metrics
+        --access-log=<file>         Log every response to this file, - logs
+                                    to stdout
+        --access-log-format=<fmt>   Format of the access log: 'common',
+                                    'combined' or 'json' (default common)
+        --access-log-size=<MiB>     Rotate the access log when it is larger
+                                    than this, 0 never does (default 0)
+        --max-connections=<n>       Serve at most this many connections per
+                                    worker at once, 0 for no limit
+                                    (default 0)
+        --when-full=<action>        What to do with more connections:
+                                    'reject' them with 503 or let them
+                                    'wait' (default reject)
+        --drain-timeout=<s>         On SIGTERM, wait this long for requests
+                                    that were received to be answered
+                                    (default 10)
+        --loop=<loop>               Event loop to use: 'asyncio', 'uvloop' or
+                                    'auto', which uses uvloop if it is
+                                    installed (default auto)
+        --vhost=<name=folder>       Also serve the site <name> from <folder>,
+                                    <name> may be a wildcard like
+                                    *.example.com, repeat for more sites
+        --default-host=<name>       Serve requests for unknown hosts from
+                                    this site instead of answering 404
+        --warm                      Load the files into the caches before
+                                    accepting connections
+        --manifest=<file>           Keep the ETags of the files in this
+                                    file, so restarts only hash the files
+                                    that changed, implies --warm
+        --warm-processes=<n>        Hash files for the manifest in this
+                                    many processes, 0 hashes them in the
+                                    server process (default 0)
+        --certfile=<file>           Serve HTTPS with the certificate chain in
+                                    this PEM file
+        --keyfile=<file>            The private key of --certfile, if it
+                                    isn't in that file
+        --sni-cert=<name=certfile>  Use another certificate for clients
+                                    that ask for the server name <name>,
+                                    which may be a wildcard, as
+                                    <name=certfile[,keyfile]>, repeat for
+                                    more names
+        --etag=<strategy>           Generate ETags from file 'stat' or from
+                                    the 'sha1' of the contents (default stat)
         -v,--verbose                Increase verbosity to INFO messages
         -d,--debug                  Increase verbosity to DEBUG messages
         --help                      Print this help message
@@ -51,8 +326,8 @@ def run(argv=None):  # pragma: no cover
     import textwrap
 
     # Check for the version
-    if not sys.version_info >= (3, 4):
-        print('This python version is not supported. Please use python 3.4')
+    if not sys.version_info >= (3, 5):
+        print('This python version is not supported. Please use python 3.5')
         exit(1)
 
     argv = argv or sys.argv[1:]
@@ -82,4 +357,51 @@ def run(argv=None):  # pragma: no cover
     port = args['--port'] or '8080'
     folder = args['<folder>'] or os.getcwd()
     hostname = args['--host'] or 'localhost'
-    _start_server(bindaddr, port, hostname, folder)
+    cache_size = int(args['--cache-size'] or 64)
+    cache_check = int(args['--cache-check'] or 0)
+    etag = args['--etag'] or 'stat'
+    workers = int(args['--workers'] or 1)
+    compress_size = int(args['--compress-size'] or 1024)
+    threads = int(args['--threads'] or 4)
+    high_water = args['--high-water'] and int(args['--high-water'])
+    low_water = args['--low-water'] and int(args['--low-water'])
+    index = args['--index'] and int(args['--index'])
+    mmap_size = int(args['--mmap-size'] or 0)
+    metrics_path = args['--metrics-path']
+    access_log = args['--access-log']
+    access_log_format = args['--access-log-format'] or 'common'
+    access_log_size = int(args['--access-log-size'] or 0)
+    max_connections = int(args['--max-connections'] or 0)
+    when_full = args['--when-full'] or 'reject'
+    drain_timeout = float(args['--drain-timeout'] or 10)
+    loop_name = args['--loop'] or 'auto'
+    for vhost in args['--vhost']:
+        if '=' not in vhost:
+            print('Expected --vhost=<name=folder>, got {}'.format(vhost))
+            exit(1)
+    vhosts = [vhost.split('=', 1) for vhost in args['--vhost']]
+    default_host = args['--default-host']
+    warm = args['--warm']
+    manifest_file = args['--manifest']
+    warm_processes = int(args['--warm-processes'] or 0)
+    certfile = args['--certfile']
+    keyfile = args['--keyfile']
+    sni_certs = []
+    for sni_cert in args['--sni-cert']:
+        name, _, files = sni_cert.partition('=')
+        if not name or not files:
+            print('Expected --sni-cert=<name=certfile>, got {}'.format(
+                sni_cert))
+            exit(1)
+        name_certfile, _, name_keyfile = files.partition(',')
+        sni_certs.append((name, name_certfile, name_keyfile or None))
+    if sni_certs and not certfile:
+        print('--sni-cert needs --certfile')
+        exit(1)
+    _start_server(bindaddr, port, hostname, folder, cache_size, cache_check,
+                  etag, workers, compress_size, threads, high_water,
+                  low_water, index, mmap_size, metrics_path, access_log,
+                  access_log_format, access_log_size, max_connections,
+                  when_full, drain_timeout, loop_name, vhosts, default_host,
+                  warm, manifest_file, warm_processes, certfile, keyfile,
+                  sni_certs)
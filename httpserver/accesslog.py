@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Access log that is written in batches from a thread"""
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+#: Supported formats: Common Log Format, Combined Log Format, JSON lines
+FORMATS = ('common', 'combined', 'json')
+
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+           'Oct', 'Nov', 'Dec')
+
+
+def _clf_time(timestamp):
+    """Format a timestamp like ``10/Oct/2000:13:55:36 +0000``"""
+    t = time.gmtime(timestamp)
+    return '{:02d}/{}/{}:{:02d}:{:02d}:{:02d} +0000'.format(
+        t.tm_mday, _MONTHS[t.tm_mon - 1], t.tm_year, t.tm_hour, t.tm_min,
+        t.tm_sec)
+
+
+def _quote(value):
+    """Quote a value for the Common Log Format"""
+    if value is None:
+        return '"-"'
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def format_entry(entry, log_format):
+    """Format an entry of the access log as a line
+
+    >>> from httpserver.messages import Request
+    >>> request = Request('GET', '/', 'HTTP/1.1')
+    >>> format_entry((0, '127.0.0.1', request, 200, 5), 'common')
+    '127.0.0.1 - - [01/Jan/1970:00:00:00 +0000] "GET / HTTP/1.1" 200 5'
+    """
+    timestamp, host, request, code, length = entry
+    if request is None:
+        request_line = referer = user_agent = None
+    else:
+        request_line = '{} {} {}'.format(
+            request.method, request.target, request.version)
+        referer = request.headers.get('Referer')
+        user_agent = request.headers.get('User-Agent')
+
+    if log_format == 'json':
+        return json.dumps({
+            'time': timestamp,
+            'host': host,
+            'request': request_line,
+            'status': code,
+            'length': length,
+            'referer': referer,
+            'user_agent': user_agent,
+        })
+
+    line = '{} - - [{}] {} {} {}'.format(
+        host or '-', _clf_time(timestamp), _quote(request_line), code,
+        '-' if length is None else length)
+    if log_format == 'combined':
+        line = '{} {} {}'.format(line, _quote(referer), _quote(user_agent))
+    return line
+
+
+class AccessLog(object):
+    """Queues entries and writes them in batches from a thread
+
+    Adding an entry only appends it to a queue, it is formatted and written
+    by the writer thread. If the writer falls behind more than
+    ``max_pending`` entries, new entries are dropped and counted.
+    """
+
+    def __init__(self, filename, log_format='common', max_size=0, backups=5,
+                 interval=0.5, max_pending=100000):
+        """Initialise an access log, call :meth:`start` to start writing
+
+        Arguments:
+            filename: the file to write to, ``-`` writes to stdout
+            log_format: one of :data:`FORMATS`
+            max_size: rotate the file when it is larger than this many
+                bytes, 0 never rotates it
+            backups: the number of rotated files to keep
+            interval: seconds between writing batches
+            max_pending: the maximum number of entries waiting to be written
+        """
+        if log_format not in FORMATS:
+            raise ValueError('Unknown access log format {}'.format(log_format))
+        self.filename = filename
+        self.log_format = log_format
+        self.max_size = max_size
+        self.backups = backups
+        self.interval = interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = collections.deque()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._file = None
+
+    def log(self, host, request, code, length):
+        """Add an entry for a response
+
+        Arguments:
+            host: the address of the client
+            request: the parsed request, or None if it couldn't be parsed
+            code: the status code of the response
+            length: the length of the body, or None if it isn't known
+        """
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((time.time(), host, request, code, length))
+
+    def start(self):
+        """Open the file and start the writer thread"""
+        self._open()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='access log')
+        self._thread.start()
+
+    def close(self):
+        """Write the remaining entries and stop the writer thread"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._write_batch()
+        if self._file is not None and self._file is not sys.stdout:
+            self._file.close()
+        self._file = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self._write_batch()
+            except OSError:
+                logger.exception('Writing the access log failed')
+
+    def _open(self):
+        if self.filename == '-':
+            self._file = sys.stdout
+        else:
+            # Unbuffered, so each batch is appended in a single write and
+            # batches of several workers don't get mixed up
+            self._file = open(self.filename, 'ab', buffering=0)
+
+    def _write_batch(self):
+        """Write all pending entries at once"""
+        if not self._pending or self._file is None:
+            return
+        lines = []
+        pending = self._pending
+        for _ in range(len(pending)):
+            lines.append(format_entry(pending.popleft(), self.log_format))
+        lines.append('')
+        if self._file is sys.stdout:
+            self._file.write('\n'.join(lines))
+            self._file.flush()
+            return
+
+        data = memoryview('\n'.join(lines).encode('utf-8'))
+        while data:
+            data = data[self._file.write(data):]
+        if self.max_size:
+            self._rotate()
+
+    def _rotate(self):
+        """Rotate the file if it is too large
+
+        If another process already rotated it, it is only opened again.
+        """
+        stat = os.fstat(self._file.fileno())
+        try:
+            current = os.stat(self.filename)
+        except FileNotFoundError:
+            current = None
+        if current is None or current.st_ino != stat.st_ino:
+            self._file.close()
+            self._open()
+            return
+        if stat.st_size < self.max_size:
+            return
+
+        self._file.close()
+        for number in range(self.backups - 1, 0, -1):
+            source = '{}.{}'.format(self.filename, number)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.filename, number + 1))
+        if self.backups > 0:
+            os.replace(self.filename, self.filename + '.1')
+        else:
+            os.unlink(self.filename)
+        self._open()
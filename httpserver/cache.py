@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Cache of the files served by :class:`httpserver.httpserver.HttpProtocol`"""
+import collections
+import copy
+import logging
+import mmap
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def stat_key(stat):
+    """Get the parts of a stat result that change when the file changes"""
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def stat_etag(stat):
+    """Get an ETag from the inode, size and modification time of a file"""
+    return '{:x}-{:x}-{:x}'.format(stat.st_ino, stat.st_size,
+                                   stat.st_mtime_ns)
+
+
+def _release(entry):
+    """Unmap the body of an entry that was removed from a cache"""
+    if isinstance(entry.body, mmap.mmap):
+        try:
+            entry.body.close()
+        except BufferError:
+            pass  # still being sent, it is unmapped when it is released
+
+
+class CacheEntry(object):
+    """A cached file
+
+    Arguments:
+        filename: the file that was read
+        stat: the result of ``os.stat`` for the file
+        etag: the ETag of the file, without quotes
+        content_type: the value for the ``Content-Type`` header
+        body: the contents of the file, or None if it is too large to keep.
+            This may be an ``mmap`` of the file, which is unmapped when the
+            entry is removed from the cache.
+        encoding: the ``Content-Encoding`` of body, if it is compressed
+    """
+
+    __slots__ = ('filename', 'key', 'etag', 'content_type', 'body',
+                 'encoding', 'checked')
+
+    def __init__(self, filename, stat, etag, content_type, body=None,
+                 encoding=None):
+        self.filename = filename
+        self.key = stat_key(stat)
+        self.etag = etag
+        self.content_type = content_type
+        self.body = body
+        self.encoding = encoding
+        self.checked = time.monotonic()
+
+    @property
+    def size(self):
+        """The size of the file in bytes"""
+        return self.key[1]
+
+    @property
+    def mtime(self):
+        """The modification time of the file in seconds"""
+        return self.key[2] / 1e9
+
+    @property
+    def weight(self):
+        """The number of bytes this entry keeps in memory"""
+        return len(self.body) if self.body is not None else 0
+
+    def variant(self, etag=None, body=None, encoding=None):
+        """Get an entry for another version of the same file
+
+        The variant is valid as long as the file doesn't change. A variant
+        without an encoding records that a version doesn't exist.
+        """
+        variant = copy.copy(self)
+        variant.etag = etag
+        variant.body = body
+        variant.encoding = encoding
+        return variant
+
+
+class FileCache(object):
+    """LRU cache of files, bounded by number of entries and total size
+
+    Entries are checked against ``os.stat`` before they are returned, so
+    changed files are never served from the cache. If ``check_interval`` is
+    set, an entry is only checked if it wasn't checked in the last
+    ``check_interval`` seconds. The cache can be used from several threads.
+
+    >>> cache = FileCache(max_entries=10)
+    >>> cache.get('/does/not/exist') is None
+    True
+    >>> cache.misses
+    1
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024, max_entries=4096,
+                 check_interval=0):
+        """Initialise an empty cache
+
+        Arguments:
+            max_size: maximum number of bytes of file contents to keep
+            max_entries: maximum number of files to keep
+            check_interval: seconds during which an entry is trusted
+                without checking the file on disk
+        """
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path, known=None):
+        """Get the entry for path if it is still valid
+
+        If ``known`` is an entry that was just checked, entries of the same
+        file are compared with it instead of checking the file again.
+        """
+        entry = self._entries.get(path)
+        # The file is checked without holding the lock
+        valid = entry is not None and self._is_valid(entry, known)
+
+        with self._lock:
+            if entry is not None and self._entries.get(path) is entry:
+                if valid:
+                    self.hits += 1
+                    self._entries.move_to_end(path)
+                    return entry
+                logger.debug('%s changed on disk', entry.filename)
+                self._discard(path)
+            self.misses += 1
+            return None
+
+    def _is_valid(self, entry, known=None):
+        """Check if the entry still matches the file on disk"""
+        if known is not None and known.filename == entry.filename:
+            return known.key == entry.key
+        now = time.monotonic()
+        if now - entry.checked < self.check_interval:
+            return True
+        try:
+            stat = os.stat(entry.filename)
+        except OSError:
+            return False
+        entry.checked = now
+        return stat_key(stat) == entry.key
+
+    def put(self, path, entry):
+        """Add an entry to the cache, evicting old entries if needed"""
+        with self._lock:
+            self._discard(path)
+            if entry.weight > self.max_size:
+                _release(entry)
+                return
+            self._entries[path] = entry
+            self.size += entry.weight
+
+            while (len(self._entries) > self.max_entries or
+                   self.size > self.max_size):
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.weight
+                self.evictions += 1
+                _release(evicted)
+
+    def discard(self, path):
+        """Remove the entry for path, if it exists"""
+        with self._lock:
+            self._discard(path)
+
+    def _discard(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.size -= entry.weight
+            _release(entry)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            for entry in self._entries.values():
+                _release(entry)
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Content negotiation for compressed responses"""
+import zlib
+
+#: Extensions of precompressed files, in order of preference
+SIDECARS = (('br', '.br'), ('gzip', '.gz'))
+
+#: Content types worth compressing apart from ``text/*``
+COMPRESSIBLE_TYPES = frozenset((
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+))
+
+
+def accepted_encodings(accept_encoding):
+    """Get the content codings accepted in an ``Accept-Encoding`` header
+
+    >>> sorted(accepted_encodings('gzip, deflate;q=0.5, br;q=0'))
+    ['deflate', 'gzip']
+    """
+    accepted = set()
+    for coding in accept_encoding.split(','):
+        coding, _, params = coding.partition(';')
+        coding = coding.strip().lower()
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding == '*':
+            accepted.update(encoding for encoding, _ in SIDECARS)
+        elif coding:
+            accepted.add(coding)
+    return accepted
+
+
+def is_compressible(content_type):
+    """Check if compressing a content type is worth it
+
+    >>> is_compressible('text/css'), is_compressible('image/png')
+    (True, False)
+    """
+    return content_type.startswith('text/') or (
+        content_type in COMPRESSIBLE_TYPES)
+
+
+def gzip_compress(data, level=6):
+    """Compress data to the gzip format
+
+    Unlike ``gzip.compress``, the output doesn't contain a timestamp, so
+    the same data always gives the same output.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Limits on the open connections and timeouts of idle connections"""
+import asyncio
+import collections
+import logging
+import math
+
+
+logger = logging.getLogger(__name__)
+
+#: What to do with new connections when the limit is reached: answer them
+#: with ``503 Service Unavailable``, or let them wait without reading from
+#: them until another connection is closed
+WHEN_FULL = ('reject', 'wait')
+
+
+class ConnectionManager(object):
+    """Tracks the open connections of a server
+
+    Timeouts are kept in a timer wheel: a ring of slots that each hold the
+    connections whose deadline falls in one ``resolution`` long tick. A
+    single timer advances the wheel, so extending a timeout only moves a
+    connection to another slot instead of rescheduling a timer.
+    """
+
+    def __init__(self, loop, max_connections=0, when_full='reject',
+                 resolution=1, slots=64):
+        """Initialise a new connection manager
+
+        Arguments:
+            loop: the event loop of the connections
+            max_connections: the maximum number of connections that are
+                served at the same time, 0 for no limit
+            when_full: one of :data:`WHEN_FULL`
+            resolution: the length of a tick of the timer wheel in seconds
+            slots: the number of slots of the timer wheel
+        """
+        if when_full not in WHEN_FULL:
+            raise ValueError('Unknown action {}'.format(when_full))
+        self.max_connections = max_connections
+        self.when_full = when_full
+        self.resolution = resolution
+        self.rejected = 0
+        self._loop = loop
+        self._active = set()
+        self._waiting = collections.deque()
+        self._wheel = [dict() for _ in range(slots)]  # protocol -> deadline
+        self._slots = dict()  # protocol -> index in the wheel
+        self._next_tick = None
+        self._timer = None
+        self._closed = None
+
+    def __len__(self):
+        return len(self._active)
+
+    @property
+    def waiting(self):
+        """The number of connections that wait to be served"""
+        return len(self._waiting)
+
+    @property
+    def full(self):
+        """Whether new connections have to wait or are rejected"""
+        return 0 < self.max_connections <= len(self._active)
+
+    def add(self, protocol):
+        """Add a new connection
+
+        Returns False if the connection can't be served now. When it has to
+        wait, its ``_admit`` method is called once it can be served.
+        """
+        if not self.full:
+            self._active.add(protocol)
+            return True
+        if self.when_full == 'wait':
+            self._waiting.append(protocol)
+        else:
+            self.rejected += 1
+        return False
+
+    def remove(self, protocol):
+        """Remove a closed connection and admit a waiting one"""
+        self._forget(protocol)
+        if protocol not in self._active:
+            try:
+                self._waiting.remove(protocol)
+            except ValueError:
+                pass
+            return
+        self._active.discard(protocol)
+        if not self._active and self._closed is not None:
+            self._closed.set_result(None)
+            self._closed = None
+        while self._waiting and not self.full:
+            waiting = self._waiting.popleft()
+            self._active.add(waiting)
+            waiting._admit()
+
+    def idle(self):
+        """Get the connections that aren't handling a request"""
+        return [protocol for protocol in self._active if protocol.idle]
+
+    async def drain(self, timeout):
+        """Shut down every connection and wait until they are closed
+
+        Idle connections are closed at once, the others once the requests
+        they received are answered. Connections that are still open after
+        timeout seconds are aborted. Returns how many were aborted.
+        """
+        for protocol in list(self._waiting) + list(self._active):
+            protocol.shutdown()
+        if not self._active:
+            return 0
+
+        logger.info('Waiting for %d connections to close', len(self._active))
+        self._closed = self._loop.create_future()
+        try:
+            await asyncio.wait_for(self._closed, timeout)
+        except asyncio.TimeoutError:
+            self._closed = None
+        aborted = list(self._active)
+        for protocol in aborted:
+            protocol.transport.abort()
+        return len(aborted)
+
+    def touch(self, protocol, timeout):
+        """Call ``protocol._handle_timeout`` after timeout seconds
+
+        Replaces an earlier timeout of the protocol.
+        """
+        now = self._loop.time()
+        deadline = now + timeout
+        index = math.ceil(deadline / self.resolution) % len(self._wheel)
+        old = self._slots.get(protocol)
+        if old is not None and old != index:
+            del self._wheel[old][protocol]
+        self._wheel[index][protocol] = deadline
+        self._slots[protocol] = index
+
+        if self._timer is None:
+            self._next_tick = int(now / self.resolution) + 1
+            self._timer = self._loop.call_at(
+                self._next_tick * self.resolution, self._advance)
+
+    def _forget(self, protocol):
+        """Remove the timeout of a protocol"""
+        index = self._slots.pop(protocol, None)
+        if index is not None:
+            del self._wheel[index][protocol]
+
+    def _advance(self):
+        """Time out the connections of every tick that has passed"""
+        now = self._loop.time()
+        current = int(now / self.resolution)
+        # A late timer may have skipped ticks, but never a whole round
+        first = max(self._next_tick, current - len(self._wheel) + 1)
+        for tick in range(first, current + 1):
+            slot = self._wheel[tick % len(self._wheel)]
+            expired = [protocol for protocol, deadline in slot.items()
+                       if deadline <= now]
+            for protocol in expired:
+                del slot[protocol]
+                del self._slots[protocol]
+                protocol._handle_timeout()
+
+        self._next_tick = current + 1
+        if self._slots:
+            self._timer = self._loop.call_at(
+                self._next_tick * self.resolution, self._advance)
+        else:
+            self._timer = None
@@ -1,31 +1,163 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import collections
+import email.utils
+import functools
 import hashlib
+import itertools
 import logging
 import mimetypes
+import mmap
 import os
 import re
-from datetime import datetime
+import time
 from http.client import responses
+from stat import S_ISREG
 from urllib.parse import unquote
 
+from .cache import CacheEntry, FileCache, stat_etag, stat_key
+from .compression import (SIDECARS, accepted_encodings, gzip_compress,
+                          is_compressible)
+from .index import url_path
+from .messages import Request, Response
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+from .ranges import parse_range, range_segments, segments_length
+from .vhosts import HostTable, VirtualHost
 
 logger = logging.getLogger(__name__)
 
+#: Files of at least this many bytes are sent straight from disk instead of
+#: being read into memory first.
+SENDFILE_THRESHOLD = 64 * 1024
 
-def _get_response(**kwargs):
-    """Get a template response
+#: Size of the reads used when the transport can't do ``sendfile``
+CHUNK_SIZE = 64 * 1024
 
-    Use kwargs to add things to the dictionary
+#: Maximum size of the request line and headers of a single request
+MAX_HEADER_SIZE = 64 * 1024
+
+#: Files up to this many bytes are memory-mapped if there is an mmap cache
+MMAP_MAX_SIZE = 64 * 1024 * 1024
+
+#: Files up to this many bytes are compressed on the fly
+COMPRESS_MAX_SIZE = 1024 * 1024
+
+#: Ways to generate ETags: from the inode, size and modification time of the
+#: file, or from a SHA-1 hash of its contents
+ETAG_STRATEGIES = ('stat', 'sha1')
+
+#: Returned instead of a response if the file system has to be accessed
+_MISSING = object()
+
+
+#: Encoded status lines for every supported version and status code
+_STATUS_LINES = {
+    (version, code): '{} {} {}\r\n'.format(version, code, reason).encode()
+    for version in ('HTTP/1.0', 'HTTP/1.1')
+    for code, reason in responses.items()
+}
+
+#: The second and ``Date`` header line that were formatted last
+_date_header = [None, b'']
+
+
+def _get_date_header():
+    """Get the ``Date`` header line, formatted at most once per second"""
+    now = int(time.time())
+    if _date_header[0] != now:
+        _date_header[0] = now
+        _date_header[1] = time.strftime(
+            'Date: %a, %d %b %Y %H:%M:%S +0000\r\n',
+            time.gmtime(now)).encode()
+    return _date_header[1]
+
+
+def _http_date(timestamp):
+    """Format a timestamp for a header like ``Last-Modified``
+
+    >>> _http_date(0)
+    'Thu, 01 Jan 1970 00:00:00 GMT'
+    """
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def _parse_http_date(value):
+    """Parse a header like ``If-Modified-Since``, None if it is invalid
+
+    >>> _parse_http_date('Thu, 01 Jan 1970 00:01:00 GMT')
+    60
     """
-    if 'code' not in kwargs:
-        kwargs['code'] = 200
-    if 'headers' not in kwargs:
-        kwargs['headers'] = dict()
-    if 'version' not in kwargs:
-        kwargs['version'] = 'HTTP/1.1'
+    try:
+        parsed = email.utils.parsedate_tz(value)
+        return email.utils.mktime_tz(parsed) if parsed else None
+    except (TypeError, ValueError, OverflowError):
+        return None
+
 
-    return dict(**kwargs)
+def _not_modified(headers, etag, mtime):
+    """Check whether a conditional request can get a 304 Not Modified
+
+    ``If-Modified-Since`` is ignored if ``If-None-Match`` is sent
+    (RFC7232-sec6).
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    since = _parse_http_date(headers.get('If-Modified-Since'))
+    return since is not None and int(mtime) <= since
+
+
+def _etag_matches(if_none_match, etag):
+    """Check if an ``If-None-Match`` header matches an ETag
+
+    >>> _etag_matches('"a", W/"b"', 'b')
+    True
+    >>> _etag_matches('"a"', 'b')
+    False
+    """
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == '"{}"'.format(etag):
+            return True
+    return False
+
+
+#: Numbers that tell connections apart in the log
+_connection_ids = itertools.count(1)
+
+
+class _ConnectionLogger(logging.LoggerAdapter):
+    """Prefixes messages with the ID of the connection
+
+    Messages are only formatted if the level is enabled.
+    """
+
+    def process(self, msg, kwargs):
+        return '[{}] {}'.format(self.extra['connection'], msg), kwargs
+
+
+def _close_file(future):
+    """Close the file of a response that won't be sent"""
+    if not future.cancelled() and future.exception() is None:
+        response = future.result()
+        if response.file is not None:
+            response.file.close()
+
+
+def _strip_body(response):
+    """Drop the body of a response to a HEAD request, but not its length"""
+    if response.body is not None:
+        body = response.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        response.headers.setdefault('Content-Length', len(body))
+        response.body = None
+    elif response.file is not None:
+        response.file.close()
+        response.file = response.mapped = None
+    response.stream = None
 
 
 class HttpProtocol(asyncio.Protocol):
@@ -34,64 +166,418 @@ class HttpProtocol(asyncio.Protocol):
     Per connection made, one of these gets instantiated
     """
 
-    def __init__(self, host, folder, event_loop=None, timeout=15):
+    def __init__(self, host, folder, event_loop=None, timeout=15,
+                 sendfile_threshold=SENDFILE_THRESHOLD, cache=None,
+                 etag='stat', compressed_cache=None,
+                 compress_max_size=COMPRESS_MAX_SIZE, executor=None,
+                 high_water=None, low_water=None, index=None,
+                 mmap_cache=None, metrics=None, metrics_path=None,
+                 access_log=None, connections=None, hosts=None,
+                 manifest=None, certificates=None):
         """Initialise a new instance.
 
         Arguments:
-            host: the host to serve
-            folder: the folder to serve files from
+            host: the host to serve, unless hosts is given
+            folder: the folder to serve files from, unless hosts is given
+            sendfile_threshold: files of this size or larger are streamed
+                from disk instead of being read into memory
+            cache: the :class:`FileCache` to share with other connections
+            etag: how to generate ETags, one of :data:`ETAG_STRATEGIES`
+            compressed_cache: the :class:`FileCache` for compressed files
+            compress_max_size: files up to this size are compressed on the
+                fly if there is no precompressed file, 0 disables this
+            executor: the executor to access the file system from when a
+                file isn't cached in memory, if None the file system is
+                accessed from the event loop
+            high_water: stop writing when the transport buffers more bytes
+                than this, None keeps the default of the event loop
+            low_water: resume writing when the transport buffers fewer bytes
+                than this, None keeps the default of the event loop
+            index: the :class:`PathIndex` of folder, if set only files in
+                the index are served, unless hosts is given
+            mmap_cache: the :class:`FileCache` for memory-mapped large
+                files, if None large files are read when they can't be sent
+                with ``sendfile``
+            metrics: the :class:`Metrics` to share with other connections
+            metrics_path: the path that serves the metrics, if not None
+            access_log: the :class:`AccessLog` to log responses to
+            connections: the :class:`ConnectionManager` that limits the
+                connections and times them out, if None this connection
+                keeps its own timer
+            hosts: the :class:`HostTable` of the sites to serve, shared
+                with other connections
+            manifest: the :class:`Manifest` with the ETags of the files
+                as they were at startup
+            certificates: the :class:`Certificates` that time the TLS
+                handshakes, if the server uses TLS
         """
+        if etag not in ETAG_STRATEGIES:
+            raise ValueError('Unknown ETag strategy {}'.format(etag))
         self.host = host
         self.folder = folder
-        self.logger = logger.getChild('HttpProtocol {}'.format(id(self)))
-        self.logger.debug('Instantiated HttpProtocol')
+        if hosts is None:
+            hosts = HostTable()
+            hosts.add(host, VirtualHost(folder, index))
+        self._hosts = hosts
+        self._manifest = manifest
+        self._certificates = certificates
+        # One logger for all connections, so none are created per connection
+        self.logger = _ConnectionLogger(
+            logger, {'connection': next(_connection_ids)})
+        self._request = None
         self._loop = event_loop or asyncio.get_event_loop()
         self._timeout = timeout
         self._timeout_handle = None
+        self._last_active = None
+        self._connections = connections
+        self._sendfile_threshold = sendfile_threshold
+        self._cache = cache if cache is not None else FileCache()
+        self._etag = etag
+        self._compressed_cache = (compressed_cache
+                                  if compressed_cache is not None
+                                  else FileCache())
+        self._compress_max_size = compress_max_size
+        self._executor = executor
+        self._high_water = high_water
+        self._low_water = low_water
+        self._mmap_cache = mmap_cache
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._metrics_path = metrics_path
+        self._requests = 0
+        self._access_log = access_log
+        self._peer = None
+        self._outgoing = collections.deque()
+        self._heads = set()  # queued responses to HEAD requests
+        self._sending = None
+        self._closing = False
+        self._write_paused = False
+        self._drain_waiter = None
+        self._buffer = bytearray()
+        self._scanned = 0
+        self._body_remaining = 0
 
     def _write_transport(self, string):
         """Convenience function to write to the transport"""
         if isinstance(string, str):  # we need to convert to bytes
-            self.transport.write(string.encode('utf-8'))
-        else:
-            self.transport.write(string)
+            string = string.encode('utf-8')
+        self.transport.write(string)
+        self._metrics.bytes_sent += len(string)
 
     def _write_response(self, response):
-        """Write the response back to the client
+        """Queue the response to be written back to the client
+
+        Responses are written in the order they are queued. The response
+        may be a future that is still being worked on, later responses wait
+        for it. A response with a ``file``, or a ``stream`` of byte chunks
+        from an async iterator, is sent asynchronously, later responses wait
+        for it as well.
 
         Arguments:
-        response -- the dictionary containing the response.
+        response -- the :class:`Response`, or a future.
+        """
+        self._outgoing.append(response)
+        if self._request is not None and self._request.method == 'HEAD':
+            self._heads.add(response)
+        if self._access_log is not None:
+            if asyncio.isfuture(response):
+                response.add_done_callback(functools.partial(
+                    self._log_future, self._request))
+            else:
+                self._log_access(self._request, response)
+        if asyncio.isfuture(response):
+            response.add_done_callback(lambda future: self._flush())
+        self._flush()
+
+    def _log_access(self, request, response):
+        """Add an entry for a response to the access log"""
+        length = response.headers.get('Content-Length')
+        if length is None and response.body is not None:
+            length = len(response.body)
+        self._access_log.log(self._peer, request, response.code, length)
+
+    def _log_future(self, request, future):
+        """Write the response of a future to the access log"""
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            response = future.result()
+        elif isinstance(error, InvalidRequestError):
+            response = error.get_http_response()
+        else:
+            response = Response(code=500)
+        self._log_access(request, response)
+
+    def _flush(self):
+        """Write out queued responses that are ready to be written
+
+        Nothing is written while the transport is paused.
+        """
+        while (self._outgoing and self._sending is None and
+               not self._write_paused):
+            queued = response = self._outgoing[0]
+            if asyncio.isfuture(response):
+                if not response.done():
+                    break
+                response = self._get_result(response)
+            self._outgoing.popleft()
+            if self._heads and queued in self._heads:
+                self._heads.discard(queued)
+                _strip_body(response)
+
+            started = time.perf_counter()
+            self._write_message(response)
+            if response.file is not None:
+                self._sending = self._loop.create_task(self._send_file(
+                    response.file, response.segments, response.mapped))
+            elif response.stream is not None:
+                self._sending = self._loop.create_task(self._send_stream(
+                    response.stream, response.version == 'HTTP/1.1'))
+            else:
+                self._observe_write(started)
+                continue
+            self._sending.add_done_callback(
+                functools.partial(self._observe_write, started))
+
+        if self._closing and not self._outgoing and self._sending is None:
+            self.transport.close()
+
+    def _observe_write(self, started, task=None):
+        """Record how long writing a response took"""
+        self._metrics.observe('write', time.perf_counter() - started)
+
+    def _get_result(self, future):
+        """Get the response from a finished future"""
+        try:
+            return future.result()
+        except InvalidRequestError as e:
+            return e.get_http_response()
+        except Exception:
+            self.logger.exception('Handling the request failed')
+            return InvalidRequestError(
+                500, 'Internal Server Error').get_http_response()
+
+    def _close(self):
+        """Close the connection once all queued responses are written"""
+        self._closing = True
+        self._flush()
+
+    def _write_message(self, response):
+        """Write the status line, headers and in-memory body
+
+        Everything is written to the transport in a single call.
+        """
+        headers = response.headers
+        body = response.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if body is not None and 'Content-Length' not in headers:
+            headers['Content-Length'] = len(body)
+        elif response.stream is not None:
+            # The length of a stream isn't known up front
+            if response.version == 'HTTP/1.1':
+                headers['Transfer-Encoding'] = 'chunked'
+            else:
+                headers.pop('Keep-Alive', None)
+                headers['Connection'] = 'close'
+        if self._closing and not self._outgoing:
+            # The last response before the connection is shut down
+            headers.pop('Keep-Alive', None)
+            headers['Connection'] = 'close'
+
+        headers = ''.join('{}: {}\r\n'.format(header, content)
+                          for header, content in headers.items())
+        head = b''.join((_STATUS_LINES[response.version, response.code],
+                         headers.encode('utf-8'),
+                         _get_date_header(),
+                         b'\r\n'))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('Sending response: %r', head)
+        self._write_transport(head if body is None else head + body)
+
+    async def _send_file(self, fp, segments, mapped=None):
+        """Send parts of an open file to the client
+
+        Segments are either bytes, which are written as they are, or
+        ``(offset, count)`` spans of the file. Uses the event loop's
+        zero-copy ``sendfile`` if the transport supports it and falls back
+        to writing the file in chunks. The chunks are slices of ``mapped``,
+        a ``memoryview`` of the mapped file, if it is given.
         """
-        status = '{} {} {}\r\n'.format(response['version'],
-                                       response['code'],
-                                       responses[response['code']])
-        self.logger.debug("Responding status: '%s'", status.strip())
-        self._write_transport(status)
+        try:
+            sendfile = getattr(self._loop, 'sendfile', None)
+            for segment in segments:
+                if isinstance(segment, bytes):
+                    self._write_transport(segment)
+                    continue
+                offset, count = segment
+                if sendfile is not None:
+                    try:
+                        self._metrics.bytes_sent += await sendfile(
+                            self.transport, fp, offset, count,
+                            fallback=False)
+                        continue
+                    except RuntimeError:
+                        # Raised if the transport is closing or doesn't
+                        # support sendfile at all.
+                        if self.transport.is_closing():
+                            return
+                        sendfile = None
+                if mapped is not None:
+                    for start in range(offset, offset + count, CHUNK_SIZE):
+                        self._write_transport(mapped[
+                            start:min(start + CHUNK_SIZE, offset + count)])
+                        await self._drain()
+                    continue
+                fp.seek(offset)
+                while count > 0:
+                    chunk = fp.read(min(CHUNK_SIZE, count))
+                    if not chunk:  # the file was truncated
+                        break
+                    self._write_transport(chunk)
+                    count -= len(chunk)
+                    await self._drain()
+        except OSError:
+            self.logger.exception('Sending file failed')
+            self.transport.abort()
+            return
+        finally:
+            fp.close()
+            self._sending = None
+        self._flush()
 
-        if 'body' in response and 'Content-Length' not in response['headers']:
-            response['headers']['Content-Length'] = len(response['body'])
+    async def _send_stream(self, stream, chunked):
+        """Send the chunks of an async iterator to the client
 
-        response['headers']['Date'] = datetime.utcnow().strftime(
-            "%a, %d %b %Y %H:%M:%S +0000")
+        With chunked transfer coding, the end of the body is marked by an
+        empty chunk. Otherwise the connection is closed after the body, and
+        responses to any later requests are dropped.
+        """
+        try:
+            async for chunk in stream:
+                if not chunk:
+                    continue
+                if chunked:
+                    chunk = b''.join(
+                        (b'%x\r\n' % len(chunk), chunk, b'\r\n'))
+                self._write_transport(chunk)
+                await self._drain()
+            if chunked:
+                self._write_transport(b'0\r\n\r\n')
+        except Exception:
+            self.logger.exception('Sending stream failed')
+            self.transport.abort()
+            return
+        finally:
+            aclose = getattr(stream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+            self._sending = None
 
-        for (header, content) in response['headers'].items():
-            self.logger.debug("Sending header: '%s: %s'", header, content)
-            self._write_transport('{}: {}\r\n'.format(header, content))
+        if not chunked:
+            self._closing = True
+            self._discard_outgoing()
+        self._flush()
 
-        self._write_transport('\r\n')
-        if 'body' in response:
-            self._write_transport(response['body'])
+    async def _drain(self):
+        """Wait until the transport wants more data
+
+        Always yields to the event loop, so other connections get a turn.
+        """
+        if not self._write_paused:
+            await asyncio.sleep(0)
+            return
+        self._drain_waiter = self._loop.create_future()
+        try:
+            await self._drain_waiter
+        finally:
+            self._drain_waiter = None
+
+    def pause_writing(self):
+        """Called when the transport's write buffer is full
+
+        Requests aren't read until the buffer drains, so a client that
+        doesn't read its responses can't make us queue more of them.
+        """
+        self.logger.debug('Pausing writing')
+        self._write_paused = True
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        """Called when the transport's write buffer has drained"""
+        self.logger.debug('Resuming writing')
+        self._write_paused = False
+        if not self._closing:
+            self.transport.resume_reading()
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+        else:
+            self._flush()
 
     def connection_made(self, transport):
         """Called when the connection is made"""
-        self.logger.info('Connection made at object %s', id(self))
+        self.logger.info('Connection made')
         self.transport = transport
         self.keepalive = True
+        self._metrics.connections += 1
+        if self._access_log is not None:
+            peer = transport.get_extra_info('peername')
+            self._peer = peer[0] if peer else None
+        self._metrics.active_connections += 1
+        if self._certificates is not None:
+            self._handshake_done(transport.get_extra_info('ssl_object'))
+        if self._high_water is not None or self._low_water is not None:
+            transport.set_write_buffer_limits(self._high_water,
+                                              self._low_water)
+
+        if self._connections is not None and not self._connections.add(self):
+            if self._connections.when_full == 'wait':
+                self.logger.info('Too many connections, waiting')
+                transport.pause_reading()
+            else:
+                self.logger.info('Too many connections, rejecting')
+                self.keepalive = False
+                self._write_response(InvalidRequestError(
+                    503, 'Too many connections').get_http_response())
+                self._close()
+                return
 
         if self._timeout:
-            self.logger.debug('Registering timeout event')
-            self._timout_handle = self._loop.call_later(
-                self._timeout, self._handle_timeout)
+            self._schedule_timeout()
+
+    def _handshake_done(self, ssl_object):
+        """Record the TLS handshake, which completed before the connection"""
+        if ssl_object is None:
+            return
+        self._metrics.handshakes += 1
+        if ssl_object.session_reused:
+            self._metrics.resumed_handshakes += 1
+        elapsed = self._certificates.handshake_time(ssl_object)
+        if elapsed is not None:
+            self._metrics.observe('handshake', elapsed)
+        self.logger.debug('TLS handshake done, %s resumed: %s',
+                          ssl_object.version(), ssl_object.session_reused)
+
+    def _admit(self):
+        """Called when a connection that had to wait can be served"""
+        self.logger.info('Connection admitted')
+        self.transport.resume_reading()
+
+    def shutdown(self):
+        """Close the connection once the requests it received are answered
+
+        Requests that arrive after this aren't read.
+        """
+        self.logger.info('Shutting down')
+        self.keepalive = False
+        self.transport.pause_reading()
+        self._close()
+
+    @property
+    def idle(self):
+        """Whether this connection isn't handling a request"""
+        return not (self._sending is not None or self._outgoing or
+                    self._buffer)
 
     def connection_lost(self, exception):
         """Called when the connection is lost or closed.
@@ -104,41 +590,125 @@ class HttpProtocol(asyncio.Protocol):
             self.logger.exception('Connection lost!')
         else:
             self.logger.info('Connection lost')
+        self._metrics.active_connections -= 1
+        if self._timeout_handle is not None:
+            self._timeout_handle.cancel()
+        if self._connections is not None:
+            self._connections.remove(self)
+
+        if self._sending is not None:
+            self._sending.cancel()
+        self._discard_outgoing()
+
+    def _discard_outgoing(self):
+        """Drop queued responses and close their files"""
+        for response in self._outgoing:
+            if asyncio.isfuture(response):
+                response.add_done_callback(_close_file)
+            elif response.file is not None:
+                response.file.close()
+        self._outgoing.clear()
+        self._heads.clear()
 
     def data_received(self, data):
         """Process received data from the socket
 
         Called when we receive data
         """
-        self.logger.debug('Received data: %s', repr(data))
+        self.logger.debug('Received %d bytes', len(data))
+        self._buffer.extend(data)
 
-        try:
-            request = self._parse_headers(data)
-            self._handle_request(request)
-        except InvalidRequestError as e:
-            self._write_response(e.get_http_response())
+        while True:
+            self._request = None
+            try:
+                started = time.perf_counter()
+                head = self._next_request()
+                if head is None:
+                    break
+                request = self._parse_headers(head)
+                self._body_remaining = self._get_content_length(request)
+                self._metrics.observe('parse', time.perf_counter() - started)
+                self._request = request
+                self._count_request()
+                self._handle_request(request)
+            except InvalidRequestError as e:
+                self._write_response(e.get_http_response())
+            if not self.keepalive:
+                # Anything after this request won't be answered
+                self._buffer.clear()
+                self._scanned = self._body_remaining = 0
+                break
 
         if not self.keepalive:
-            if self._timeout_handle:
-                self._timeout_handle.cancel()
-            self.transport.close()
+            self._close()
 
-        if self._timeout and self._timeout_handle:
-            self.logger.debug('Delaying timeout event')
-            self._timeout_handle.cancel()
-            self._timout_handle = self._loop.call_later(
-                self._timeout, self._handle_timeout)
+        if self._timeout:
+            self._schedule_timeout()
+
+    def _count_request(self):
+        """Count a request, and whether the connection was used before"""
+        self._metrics.requests += 1
+        if self._requests:
+            self._metrics.keepalive_reuses += 1
+        self._requests += 1
+
+    def _next_request(self):
+        """Take the head of the next complete request from the buffer
+
+        Skips the body of the previous request. Returns None if the buffer
+        doesn't hold a complete request head yet. Bytes that were already
+        searched for the end of the head are not searched again.
+        """
+        if self._body_remaining:
+            skipped = min(self._body_remaining, len(self._buffer))
+            del self._buffer[:skipped]
+            self._body_remaining -= skipped
+            if self._body_remaining:
+                return None
+
+        # Ignore empty lines in front of a request (RFC2616-sec4.1)
+        while self._buffer.startswith(b'\r\n'):
+            del self._buffer[:2]
+
+        end = self._buffer.find(b'\r\n\r\n', self._scanned)
+        if end == -1:
+            if len(self._buffer) > MAX_HEADER_SIZE:
+                self.keepalive = False
+                raise InvalidRequestError(431, 'Request headers too large')
+            # the end marker could start in the last three bytes
+            self._scanned = max(0, len(self._buffer) - 3)
+            return None
+
+        head = bytes(self._buffer[:end])
+        del self._buffer[:end + 4]
+        self._scanned = 0
+        return head
+
+    def _get_content_length(self, request):
+        """Get the length of the request body that needs to be skipped"""
+        if 'Transfer-Encoding' in request.headers:
+            self.keepalive = False  # we can't find the next request
+            raise InvalidRequestError(501, 'Transfer-Encoding not supported')
+        try:
+            length = int(request.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.keepalive = False
+            raise InvalidRequestError(400, 'Invalid Content-Length')
+        return length
 
     def _parse_headers(self, data):
         self.logger.debug('Parsing headers')
 
-        request_strings = list(map(lambda x: x.decode('utf-8'),
-                                   data.split(b'\r\n')))
-
-        request = dict()
+        lines = data.split(b'\r\n')
+        try:
+            method_line = lines[0].decode('utf-8').split()
+        except UnicodeDecodeError:
+            self.keepalive = False
+            raise InvalidRequestError(400, 'Bad request')
 
         # Parse request method and HTTP version
-        method_line = request_strings[0].split()
 
         # The first line has either 3 or 2 arguments
         if not (2 <= len(method_line) <= 3):
@@ -151,21 +721,17 @@ class HttpProtocol(asyncio.Protocol):
             self.keepalive = False  # HTTP/0.9 won't support persistence
             raise InvalidRequestError(505, "This server only supports HTTP/1.0"
                                            "and HTTP/1.1")
-        else:
-            request['version'] = method_line[2]
+        request = Request(method_line[0], method_line[1], method_line[2])
 
-        # method
-        request['method'] = method_line[0]
-        # request URI
-        request['target'] = method_line[1]
-
-        # Parse the headers
-        for line in request_strings[1:]:
-            if line == '':  # an empty line signals the end of the headers
+        # Parse the headers, their values are only decoded when needed
+        for line in lines[1:]:
+            if line == b'':  # an empty line signals the end of the headers
                 break
-            self.logger.debug("header: '%s'", line)
-            header, body = line.split(': ', 1)
-            request[header] = body
+            header, colon, body = line.partition(b':')
+            if not colon:
+                self.keepalive = False
+                raise InvalidRequestError(400, 'Bad request')
+            request.headers.add(header, body.strip())
 
         self.logger.debug('request object: %s', request)
         return request
@@ -174,9 +740,9 @@ class HttpProtocol(asyncio.Protocol):
         """Parse the request URI into something useful
 
         Server MUST accept full URIs (5.1.2)"""
-        request_uri = request['target']
+        request_uri = request.target
         if request_uri.startswith('/'):  # eg. GET /index.html
-            return (request.get('Host', 'localhost').split(':')[0],
+            return (request.headers.get('Host', 'localhost').split(':')[0],
                     request_uri[1:])
         elif '://' in request_uri:  # eg. GET http://rded.nl
             locator = request_uri.split('://', 1)[1]
@@ -187,15 +753,17 @@ class HttpProtocol(asyncio.Protocol):
         """Process the headers and get the file"""
 
         # Check if this is a persistent connection.
-        if request['version'] == 'HTTP/1.1':
-            self.keepalive = not request.get('Connection') == 'close'
-        elif request['version'] == 'HTTP/1.0':
-            self.keepalive = request.get('Connection') == 'Keep-Alive'
+        connection = {option.strip() for option in
+                      request.headers.get('Connection', '').lower().split(',')}
+        if request.version == 'HTTP/1.1':
+            self.keepalive = 'close' not in connection
+        elif request.version == 'HTTP/1.0':
+            self.keepalive = 'keep-alive' in connection
 
         # Check if we're getting a sane request
-        if request['method'] not in ('GET'):
+        if request.method not in ('GET', 'HEAD'):
             raise InvalidRequestError(501, 'Method not implemented')
-        if request['version'] not in ('HTTP/1.0', 'HTTP/1.1'):
+        if request.version not in ('HTTP/1.0', 'HTTP/1.1'):
             raise InvalidRequestError(
                 505, 'Version not supported. Supported versions are: {}, {}'
                 .format('HTTP/1.0', 'HTTP/1.1'))
@@ -204,27 +772,37 @@ class HttpProtocol(asyncio.Protocol):
 
         # We must ignore the Host header if a host is specified in GET
         if host is None:
-            host = request.get('Host')
+            host = request.headers.get('Host')
 
         # Check if this request is intended for this webserver
-        if host is not None and not host == self.host:
+        vhost = self._hosts.get(host)
+        if vhost is None:
             self.logger.info('Got a request for unknown host %s', host)
             raise InvalidRequestError(404, "We don't serve this host")
 
-        filename = os.path.join(self.folder, unquote(location))
-        self.logger.debug('trying to serve %s', filename)
-
-        if os.path.isdir(filename):
-            filename = os.path.join(filename, 'index.html')
+        # Metrics are served without touching the file system
+        if (self._metrics_path is not None and
+                '/' + location == self._metrics_path):
+            self._write_response(self._get_metrics_response(request))
+            return
 
-        if not os.path.isfile(filename):
-            raise InvalidRequestError(404, 'Not Found')
+        started = time.perf_counter()
+        location = unquote(location)
+        if vhost.index is not None:
+            filename = vhost.index.get(location)
+            if filename is None:
+                raise InvalidRequestError(404, 'Not Found')
+        else:
+            # Never serve anything outside the folder
+            filename = os.path.join(vhost.folder, url_path(location))
+        self.logger.debug('trying to serve %s', filename)
 
         # Start response with version
-        response = _get_response(version=request['version'])
+        response = Response(version=request.version)
 
         # timeout negotiation
-        match = re.match(r'timeout=(\d+)', request.get('Keep-Alive', ''))
+        match = re.match(r'timeout=(\d+)',
+                         request.headers.get('Keep-Alive', ''))
         if match is not None:
             requested_timeout = int(match.group(1))
             if requested_timeout < self._timeout:
@@ -232,32 +810,398 @@ class HttpProtocol(asyncio.Protocol):
 
         # tell the client our timeout
         if self.keepalive:
-            response['headers'][
-                'Keep-Alive'] = 'timeout={}'.format(self._timeout)
+            response.headers['Keep-Alive'] = 'timeout={}'.format(
+                self._timeout)
 
-        # Set Content-Type
-        response['headers']['Content-Type'] = mimetypes.guess_type(
-            filename)[0] or 'text/plain'
+        entry = self._cache.get(filename)
+        if entry is None and (request.method == 'HEAD' or
+                              'If-None-Match' in request.headers or
+                              'If-Modified-Since' in request.headers):
+            result = self._get_stat_response(request, response, filename)
+            if result is not None:
+                self._metrics.observe('lookup', time.perf_counter() - started)
+                self._write_response(result)
+                return
+        self._metrics.observe('lookup', time.perf_counter() - started)
+        if self._executor is None:
+            self._write_response(
+                self._get_file_response(request, response, filename, entry))
+            return
 
-        # Generate E-tag
-        sha1 = hashlib.sha1()
-        with open(filename, 'rb') as fp:
-            response['body'] = fp.read()
-            sha1.update(response['body'])
-        etag = sha1.hexdigest()
+        # Only go to the executor if the file system has to be accessed
+        result = self._get_file_response(request, response, filename, entry,
+                                         cached_only=True)
+        if result is _MISSING:
+            result = self._loop.run_in_executor(
+                self._executor, self._get_file_response,
+                request, response, filename, entry)
+        self._write_response(result)
+
+    def _get_file_response(self, request, response, filename, entry,
+                           cached_only=False):
+        """Complete the response with the requested file
+
+        ``entry`` is the cached entry for filename, or None if it isn't
+        cached. If ``cached_only`` is set, returns ``_MISSING`` if the file
+        system has to be accessed, otherwise this can run in the executor.
+        """
+        if entry is None:
+            if cached_only:
+                return _MISSING
+            started = time.perf_counter()
+            entry = self._load_file(filename)
+            self._metrics.observe('read', time.perf_counter() - started)
+            self._cache.put(filename, entry)
+
+        compressible = is_compressible(entry.content_type)
+        if compressible:
+            compressed = self._get_compressed(
+                entry, request.headers.get('Accept-Encoding', ''),
+                request.headers.get('If-None-Match', ''), cached_only)
+            if compressed is _MISSING:
+                return _MISSING
+            entry = compressed or entry
+
+        etag = entry.etag
+        not_modified = _not_modified(request.headers, etag, entry.mtime)
+        if cached_only and entry.body is None and not not_modified:
+            return _MISSING
+
+        # Set Content-Type
+        response.headers['Content-Type'] = entry.content_type
+        if entry.encoding is not None:
+            response.headers['Content-Encoding'] = entry.encoding
 
         # Create 304 response if if-none-match matches etag
-        if request.get('If-None-Match') == '"{}"'.format(etag):
+        if not_modified:
             # 304 responses shouldn't contain many headers we might already
             # have added.
-            response = _get_response(code=304)
+            response = Response(code=304)
+        else:
+            response = self._get_body(request, response, entry, filename)
+
+        if compressible:
+            response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Etag'] = '"{}"'.format(etag)
+        response.headers['Last-Modified'] = _http_date(entry.mtime)
+        return response
 
-        response['headers']['Etag'] = '"{}"'.format(etag)
+    def _get_stat_response(self, request, response, filename):
+        """Answer a HEAD or conditional request from ``os.stat`` alone
+
+        This works if the ETag is derived from the stat and the client gets
+        the file uncompressed. Returns None if the file has to be read, eg.
+        for a GET of a modified file.
+        """
+        if self._etag != 'stat':
+            return None
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, 'index.html')
+        content_type = mimetypes.guess_type(filename)[0] or 'text/plain'
+        compressible = is_compressible(content_type)
+        if compressible:
+            accepted = accepted_encodings(
+                request.headers.get('Accept-Encoding', ''))
+            if any(encoding in accepted for encoding, _ in SIDECARS):
+                return None
+        try:
+            file_stat = os.stat(filename)
+        except OSError:
+            raise InvalidRequestError(404, 'Not Found')
+        if not S_ISREG(file_stat.st_mode):
+            raise InvalidRequestError(404, 'Not Found')
+
+        etag = stat_etag(file_stat)
+        if _not_modified(request.headers, etag, file_stat.st_mtime):
+            response = Response(code=304)
+        elif request.method == 'HEAD':
+            response.headers['Content-Type'] = content_type
+            response.headers['Accept-Ranges'] = 'bytes'
+            response.headers['Content-Length'] = file_stat.st_size
+        else:
+            return None
+
+        if compressible:
+            response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Etag'] = '"{}"'.format(etag)
+        response.headers['Last-Modified'] = _http_date(file_stat.st_mtime)
+        return response
+
+    def _get_metrics_response(self, request):
+        """Get a response with the metrics in the Prometheus text format"""
+        extra = [
+            ('cache_hits_total', 'counter', 'File cache hits',
+             self._cache.hits),
+            ('cache_misses_total', 'counter', 'File cache misses',
+             self._cache.misses),
+            ('cache_size_bytes', 'gauge', 'Bytes of files in the cache',
+             self._cache.size),
+        ]
+        if self._connections is not None:
+            extra.extend([
+                ('rejected_connections_total', 'counter',
+                 'Connections rejected because of the connection limit',
+                 self._connections.rejected),
+                ('waiting_connections', 'gauge',
+                 'Connections waiting for the connection limit',
+                 self._connections.waiting),
+            ])
+        return Response(
+            version=request.version,
+            headers={
+                'Content-Type': METRICS_CONTENT_TYPE,
+                'Cache-Control': 'no-cache',
+            },
+            body=self._metrics.render(extra))
 
-        self._write_response(response)
+    def _get_body(self, request, response, entry, filename):
+        """Add the file, or the requested ranges of it, to the response
+
+        Returns the response, which is replaced if the requested range can't
+        be satisfied.
+        """
+        fp = None
+        if entry.body is not None:
+            size = len(entry.body)
+        else:
+            # Large files are sent from disk
+            try:
+                fp = open(entry.filename, 'rb')
+            except OSError:
+                self._cache.discard(filename)
+                raise InvalidRequestError(404, 'Not Found')
+            size = os.fstat(fp.fileno()).st_size
+
+        segments = [(0, size)]
+        response.headers['Accept-Ranges'] = 'bytes'
+        ranges = None
+        etag = '"{}"'.format(entry.etag)
+        range_header = request.headers.get('Range')
+        if (range_header is not None and
+                request.headers.get('If-Range', etag) == etag):
+            ranges = parse_range(range_header, size)
+
+        if ranges == []:
+            if fp is not None:
+                fp.close()
+            return Response(
+                code=416,
+                version=response.version,
+                headers={'Content-Range': 'bytes */{}'.format(size)},
+                body=b'')
+        elif ranges:
+            response.code = 206
+            headers, segments = range_segments(ranges, size,
+                                               entry.content_type)
+            response.headers.update(headers)
+
+        if fp is None:
+            response.body = b''.join(
+                segment if isinstance(segment, bytes)
+                else entry.body[segment[0]:segment[0] + segment[1]]
+                for segment in segments)
+        else:
+            response.file = fp
+            response.segments = segments
+            if self._mmap_cache is not None and 0 < size <= MMAP_MAX_SIZE:
+                response.mapped = self._get_mapped(entry, fp)
+            response.headers['Content-Length'] = segments_length(segments)
+        return response
+
+    def _get_mapped(self, entry, fp):
+        """Get a ``memoryview`` of the mapped file of entry, or None
+
+        Mappings are kept in the mmap cache until the file changes, so
+        clients that fetch the same file share them. The view keeps the
+        mapping from being closed while it is sent.
+        """
+        mapped = self._mmap_cache.get(entry.filename, known=entry)
+        if mapped is None:
+            if stat_key(os.fstat(fp.fileno())) != entry.key:
+                return None
+            mapped = entry.variant(entry.etag, mmap.mmap(
+                fp.fileno(), 0, access=mmap.ACCESS_READ), entry.encoding)
+            self._mmap_cache.put(entry.filename, mapped)
+        try:
+            return memoryview(mapped.body)
+        except ValueError:  # evicted by another thread in the meantime
+            return None
+
+    def _get_compressed(self, entry, accept_encoding, if_none_match='',
+                        cached_only=False):
+        """Get a compressed version of a file that the client accepts
+
+        Precompressed files next to the file (``foo.js.gz``) are preferred,
+        otherwise small enough files are compressed with gzip. Returns None
+        if no acceptable compressed version is available.
+
+        Versions that don't exist are cached too, until the file changes.
+        If the client already has the gzipped version, an entry without a
+        body is returned instead of compressing the file again. If
+        ``cached_only`` is set, returns ``_MISSING`` if a version that the
+        client accepts isn't cached.
+        """
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, extension in SIDECARS:
+            if encoding not in accepted:
+                continue
+            key = (entry.filename, encoding)
+            compressed = self._compressed_cache.get(key, known=entry)
+            if compressed is None:
+                if cached_only:
+                    return _MISSING
+                compressed = self._load_sidecar(entry, encoding, extension)
+                if compressed is None and encoding == 'gzip':
+                    etag = '{}-gzip'.format(entry.etag)
+                    if _etag_matches(if_none_match, etag):
+                        return entry.variant(etag, encoding=encoding)
+                    compressed = self._compress(entry)
+                if compressed is None:
+                    compressed = entry.variant()
+                self._compressed_cache.put(key, compressed)
+            if compressed.encoding is not None:
+                return compressed
+
+    def _load_sidecar(self, entry, encoding, extension):
+        """Load the precompressed version of a file, if it exists"""
+        filename = entry.filename + extension
+        if not os.path.isfile(filename):
+            return None
+        sidecar = self._load_file(filename)
+        sidecar.content_type = entry.content_type
+        sidecar.encoding = encoding
+        return sidecar
+
+    def _compress(self, entry):
+        """Compress a file with gzip, if that makes it smaller"""
+        if not 0 < entry.size <= self._compress_max_size:
+            return None
+        body = entry.body
+        if body is None:
+            with open(entry.filename, 'rb') as fp:
+                body = fp.read()
+        compressed = gzip_compress(body)
+        if len(compressed) >= len(body):
+            return None
+        # The stat of the original file keeps this version valid
+        if stat_key(os.stat(entry.filename)) != entry.key:
+            return None
+        return entry.variant('{}-gzip'.format(entry.etag), compressed, 'gzip')
+
+    def _load_file(self, filename):
+        """Read a file and get everything needed to serve it
+
+        Small files are kept in memory. Large files are only read if the
+        ETag is a hash of the contents. Raises a 404 error if the file
+        doesn't exist.
+        """
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, 'index.html')
+
+        if not os.path.isfile(filename):
+            raise InvalidRequestError(404, 'Not Found')
+
+        content_type = mimetypes.guess_type(filename)[0] or 'text/plain'
+
+        body = None
+        with open(filename, 'rb') as fp:
+            stat = os.fstat(fp.fileno())
+            if stat.st_size < self._sendfile_threshold:
+                body = fp.read()
+
+            # Generate E-tag
+            known = None
+            if self._manifest is not None:
+                known = self._manifest.get(filename, stat_key(stat))
+            if self._etag == 'stat':
+                etag = stat_etag(stat)
+            elif known is not None:
+                etag = known[0]
+            elif body is not None:
+                etag = hashlib.sha1(body).hexdigest()
+            else:
+                sha1 = hashlib.sha1()
+                for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+                    sha1.update(chunk)
+                etag = sha1.hexdigest()
+
+        return CacheEntry(filename, stat, etag, content_type, body)
+
+    def warm(self):
+        """Load the files of the manifest into the caches
+
+        Files are loaded until the caches are full, with the compressed
+        versions that clients are likely to accept. Returns the number of
+        files that were loaded.
+        """
+        folders = {os.path.join(folder, '') for folder in
+                   self._manifest.folders}
+        sidecars = tuple(extension for _, extension in SIDECARS)
+        loaded = 0
+        for filename, (key, _, _) in self._manifest.files.items():
+            if filename.endswith(sidecars):
+                continue  # loaded with the file they belong to
+            size = key[1]
+            if size < self._sendfile_threshold and (
+                    self._cache.size + size > self._cache.max_size):
+                continue
+            if len(self._cache) >= self._cache.max_entries:
+                break
+            try:
+                entry = self._load_file(filename)
+            except (InvalidRequestError, OSError):
+                continue
+            self._cache.put(filename, entry)
+            if os.path.basename(filename) == 'index.html':
+                # Requests for the directory are cached under its path
+                directory = os.path.dirname(filename)
+                if os.path.join(directory, '') in folders:
+                    directory = os.path.join(directory, '')
+                self._cache.put(directory, entry)
+            loaded += 1
+
+            if not is_compressible(entry.content_type):
+                continue
+            for encoding, _ in SIDECARS:
+                if (self._compressed_cache.size >=
+                        self._compressed_cache.max_size):
+                    break
+                try:
+                    self._get_compressed(entry, encoding)
+                except (InvalidRequestError, OSError):
+                    pass
+        return loaded
+
+    def _schedule_timeout(self):
+        """Close the connection if it stays idle for the timeout
+
+        Without a connection manager, the timer isn't rescheduled on every
+        request. Instead it checks when the connection was last active.
+        """
+        if self._connections is not None:
+            self._connections.touch(self, self._timeout)
+            return
+        self._last_active = self._loop.time()
+        if self._timeout_handle is None:
+            self._timeout_handle = self._loop.call_later(
+                self._timeout, self._check_timeout)
+
+    def _check_timeout(self):
+        """Called by the timer of this connection"""
+        self._timeout_handle = None
+        idle = self._loop.time() - self._last_active
+        if idle < self._timeout:
+            self._timeout_handle = self._loop.call_later(
+                self._timeout - idle, self._check_timeout)
+        else:
+            self._handle_timeout()
 
     def _handle_timeout(self):
         """Handle a timeout"""
+        if self._sending is not None or self._outgoing:
+            # Don't cut off a response that is still being sent
+            self._schedule_timeout()
+            return
         self.logger.info('Request timed out')
         self.transport.close()
 
@@ -279,7 +1223,7 @@ class InvalidRequestError(Exception):
 
     def get_http_response(self):
         """Get this exception as an HTTP response suitable for output"""
-        return _get_response(
+        return Response(
             code=self.code,
             body=str(self),
             headers={
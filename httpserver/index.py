@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Index of the files in the served folder"""
+import logging
+import os
+import posixpath
+
+
+logger = logging.getLogger(__name__)
+
+
+def url_path(location):
+    """Normalise the unquoted path of a URL
+
+    The result has no leading slash and ``..`` can't climb above the root.
+
+    >>> url_path('/a/./b/../c'), url_path('../../etc/passwd'), url_path('/')
+    ('a/c', 'etc/passwd', '')
+    """
+    return posixpath.normpath('/' + location).lstrip('/')
+
+
+class PathIndex(object):
+    """Maps URL paths to the files in a folder
+
+    Paths are looked up without touching the file system, and anything that
+    isn't in the folder isn't in the index. A directory maps to its
+    ``index.html``. The index only changes when the folder is scanned again.
+
+    >>> index = PathIndex('/does/not/exist')
+    >>> index.get('/index.html') is None
+    True
+    """
+
+    def __init__(self, folder):
+        """Initialise an empty index
+
+        Arguments:
+            folder: the folder to index
+        """
+        self.folder = folder
+        self._paths = dict()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def get(self, location):
+        """Get the filename for the unquoted path of a URL, or None"""
+        return self._paths.get(url_path(location))
+
+    def scan(self):
+        """Build the index from the files in the folder
+
+        The new index replaces the old one at once, so this can run in
+        another thread while the index is used.
+        """
+        paths = dict()
+        for dirpath, _, filenames in os.walk(self.folder):
+            relpath = os.path.relpath(dirpath, self.folder)
+            prefix = '' if relpath == '.' else (
+                relpath.replace(os.sep, '/') + '/')
+            for name in filenames:
+                paths[prefix + name] = os.path.join(dirpath, name)
+            if 'index.html' in filenames:
+                paths[prefix.rstrip('/')] = os.path.join(dirpath,
+                                                         'index.html')
+        self._paths = paths
+        logger.debug('Indexed %d paths in %s', len(paths), self.folder)
+
+    def rescan_every(self, loop, interval, executor=None):
+        """Scan the folder again every interval seconds
+
+        Scans run in the executor, so they don't block the event loop.
+        """
+        def rescan():
+            loop.run_in_executor(executor, self.scan).add_done_callback(
+                scanned)
+
+        def scanned(future):
+            if future.exception() is not None:
+                logger.error('Scanning %s failed: %s', self.folder,
+                             future.exception())
+            loop.call_later(interval, rescan)
+
+        loop.call_later(interval, rescan)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Selecting the event loop implementation"""
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+#: Event loops that can be selected, ``auto`` prefers uvloop if installed
+LOOPS = ('auto', 'asyncio', 'uvloop')
+
+
+def resolve(name='auto'):
+    """Get the loop that is used for a loop from :data:`LOOPS`
+
+    If uvloop isn't installed, the default asyncio loop is used instead.
+
+    >>> resolve('asyncio')
+    'asyncio'
+    """
+    if name not in LOOPS:
+        raise ValueError('Unknown event loop {}'.format(name))
+    if name == 'asyncio':
+        return name
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        if name == 'uvloop':
+            logger.warning('uvloop is not installed, using asyncio')
+        return 'asyncio'
+    return 'uvloop'
+
+
+def install(name='auto'):
+    """Install the event loop policy for a loop from :data:`LOOPS`
+
+    Call this before the event loop is created. Returns the name of the
+    loop that will be used.
+    """
+    name = resolve(name)
+    if name == 'uvloop':
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return name
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Manifest of the served files, kept between restarts"""
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+
+from .cache import stat_etag, stat_key
+
+
+logger = logging.getLogger(__name__)
+
+#: Version of the manifest file format
+VERSION = 1
+
+#: Size of the reads when hashing a file
+_CHUNK_SIZE = 64 * 1024
+
+
+def sha1_file(filename):
+    """Get the SHA-1 hash of a file, as used for ETags"""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class Manifest(object):
+    """The ETags, content types and stats of the files in some folders
+
+    Building the manifest hashes every file if ETags are SHA-1 hashes.
+    A manifest that is loaded from an earlier run only needs the files that
+    changed since to be hashed again.
+
+    >>> manifest = Manifest()
+    >>> manifest.scan(['/does/not/exist'])
+    0
+    >>> manifest.get('/does/not/exist/index.html', (1, 2, 3)) is None
+    True
+    """
+
+    def __init__(self, etag='stat'):
+        """Initialise an empty manifest
+
+        Arguments:
+            etag: how the ETags are generated, one of
+                :data:`httpserver.httpserver.ETAG_STRATEGIES`
+        """
+        self.etag = etag
+        self.folders = []
+        self.files = dict()  # filename -> (stat key, etag, content type)
+
+    def __len__(self):
+        return len(self.files)
+
+    def get(self, filename, key):
+        """Get the ETag and content type of a file if it didn't change
+
+        Arguments:
+            filename: the file
+            key: the :func:`stat_key` of the file as it is now
+        """
+        record = self.files.get(filename)
+        if record is None or record[0] != key:
+            return None
+        return record[1:]
+
+    def scan(self, folders, previous=None, executor=None):
+        """Add the files in folders, returns the number that were hashed
+
+        Arguments:
+            folders: the folders to walk
+            previous: a manifest from an earlier run, its records of files
+                that didn't change are used as they are
+            executor: the executor to hash files in, eg. a process pool
+        """
+        if previous is not None and previous.etag != self.etag:
+            previous = None
+        self.folders.extend(folders)
+        changed = []
+        for folder in folders:
+            for dirpath, _, filenames in os.walk(folder):
+                for name in filenames:
+                    filename = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(filename)
+                    except OSError:
+                        continue
+                    key = stat_key(stat)
+                    if previous is not None:
+                        record = previous.files.get(filename)
+                        if record is not None and record[0] == key:
+                            self.files[filename] = record
+                            continue
+                    content_type = (mimetypes.guess_type(filename)[0] or
+                                    'text/plain')
+                    self.files[filename] = (key, stat_etag(stat),
+                                            content_type)
+                    changed.append(filename)
+
+        if self.etag != 'sha1':
+            return 0
+        hashes = (executor.map(sha1_file, changed) if executor is not None
+                  else map(sha1_file, changed))
+        for filename, etag in zip(changed, hashes):
+            key, _, content_type = self.files[filename]
+            self.files[filename] = (key, etag, content_type)
+        logger.info('Hashed %d of %d files', len(changed), len(self.files))
+        return len(changed)
+
+    @classmethod
+    def load(cls, path, etag='stat'):
+        """Load a manifest, or get an empty one if it can't be loaded"""
+        manifest = cls(etag)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data['version'] != VERSION:
+                raise ValueError('Unknown version {}'.format(data['version']))
+            manifest.etag = data['etag']
+            manifest.files = {
+                filename: (tuple(record[:3]), record[3], record[4])
+                for filename, record in data['files'].items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            logger.warning('Ignoring manifest %s: %s', path, e)
+        return manifest
+
+    def save(self, path):
+        """Write the manifest to a file, replacing it at once"""
+        data = {
+            'version': VERSION,
+            'etag': self.etag,
+            'files': {filename: list(key) + [etag, content_type]
+                      for filename, (key, etag, content_type)
+                      in self.files.items()},
+        }
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Requests, responses and their header fields"""
+
+#: Lowercased bytes keys of the header names that are looked up
+_keys = dict()
+
+
+def _key(name):
+    """Get the key of a header name"""
+    key = _keys.get(name)
+    if key is None:
+        key = _keys[name] = name.lower().encode('latin-1')
+    return key
+
+
+class Headers(object):
+    """Case-insensitive multimap of header fields
+
+    Names are kept as lowercased bytes and values as bytes, which are only
+    decoded when they are looked up. Fields with the same name are combined
+    into a comma-separated list (RFC7230-sec3.2.2).
+
+    >>> headers = Headers()
+    >>> headers.add(b'Accept-Encoding', b'gzip')
+    >>> headers.add(b'accept-encoding', b'br')
+    >>> headers.get('ACCEPT-ENCODING'), 'accept-Encoding' in headers
+    ('gzip, br', True)
+    """
+
+    __slots__ = ('_fields',)
+
+    def __init__(self):
+        self._fields = dict()  # name -> [value]
+
+    def __contains__(self, name):
+        return _key(name) in self._fields
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return 'Headers({!r})'.format(dict(self.items()))
+
+    def add(self, name, value):
+        """Add a field, name and value are the bytes that were received"""
+        values = self._fields.get(name.lower())
+        if values is None:
+            self._fields[name.lower()] = [value]
+        else:
+            values.append(value)
+
+    def get(self, name, default=None):
+        """Get the value of a field, or default if it isn't there"""
+        values = self._fields.get(_key(name))
+        if values is None:
+            return default
+        return b', '.join(values).decode('latin-1')
+
+    def get_all(self, name):
+        """Get the values of every field with a name"""
+        return [value.decode('latin-1')
+                for value in self._fields.get(_key(name), ())]
+
+    def items(self):
+        """Get the lowercased names and the values of all fields"""
+        return [(name.decode('latin-1'), b', '.join(values).decode('latin-1'))
+                for name, values in self._fields.items()]
+
+
+class Request(object):
+    """A parsed request head"""
+
+    __slots__ = ('method', 'target', 'version', 'headers')
+
+    def __init__(self, method, target, version, headers=None):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers if headers is not None else Headers()
+
+    def __repr__(self):
+        return 'Request({!r}, {!r}, {!r}, {!r})'.format(
+            self.method, self.target, self.version, self.headers)
+
+
+class Response(object):
+    """A response that is queued to be written
+
+    The body is either in memory as ``body``, the ``segments`` of an open
+    ``file`` (optionally ``mapped`` into memory), or a ``stream`` of byte
+    chunks from an async iterator. A response without any of these has no
+    body, like a ``304 Not Modified``. Header names are written as they are
+    given.
+    """
+
+    __slots__ = ('code', 'version', 'headers', 'body', 'file', 'segments',
+                 'mapped', 'stream')
+
+    def __init__(self, code=200, version='HTTP/1.1', headers=None, body=None,
+                 file=None, segments=None, mapped=None, stream=None):
+        self.code = code
+        self.version = version
+        self.headers = headers if headers is not None else dict()
+        self.body = body
+        self.file = file
+        self.segments = segments
+        self.mapped = mapped
+        self.stream = stream
+
+    def __repr__(self):
+        return 'Response({!r}, {!r}, {!r})'.format(
+            self.code, self.version, self.headers)
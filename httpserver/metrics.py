@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Timing histograms and counters, in the Prometheus text format"""
+import bisect
+import threading
+
+#: Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#: The ``Content-Type`` of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Histogram(object):
+    """Counts observed values in buckets
+
+    >>> histogram = Histogram()
+    >>> histogram.observe(0.003)
+    >>> histogram.count, histogram.counts[BUCKETS.index(0.005)]
+    (1, 1)
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Add a value, observations may come from several threads"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def render(self, name):
+        """Get the lines of this histogram in the Prometheus text format"""
+        lines = []
+        total = 0
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, total))
+        lines.append('{}_sum {!r}'.format(name, float(self.sum)))
+        lines.append('{}_count {}'.format(name, self.count))
+        return lines
+
+
+class Metrics(object):
+    """Metrics shared by the connections of a server
+
+    The histograms time parts of handling a request. The counters are
+    updated from the event loop only.
+    """
+
+    #: The histograms, with their help text
+    HISTOGRAMS = (
+        ('parse', 'Time spent parsing request heads'),
+        ('lookup', 'Time spent finding the requested file'),
+        ('read', 'Time spent reading and hashing files'),
+        ('write', 'Time spent writing responses'),
+        ('handshake', 'Time spent on TLS handshakes'),
+    )
+
+    def __init__(self):
+        self.histograms = {name: Histogram() for name, _ in self.HISTOGRAMS}
+        self.active_connections = 0
+        self.connections = 0
+        self.requests = 0
+        self.keepalive_reuses = 0
+        self.bytes_sent = 0
+        self.handshakes = 0
+        self.resumed_handshakes = 0
+
+    def observe(self, name, seconds):
+        """Add a duration to a histogram"""
+        self.histograms[name].observe(seconds)
+
+    def render(self, extra=()):
+        """Get all metrics in the Prometheus text format
+
+        Arguments:
+            extra: more ``(name, type, help, value)`` metrics to include
+        """
+        metrics = [
+            ('active_connections', 'gauge', 'Open connections',
+             self.active_connections),
+            ('connections_total', 'counter', 'Accepted connections',
+             self.connections),
+            ('requests_total', 'counter', 'Requests handled', self.requests),
+            ('keepalive_reuses_total', 'counter',
+             'Requests on a connection that was used before',
+             self.keepalive_reuses),
+            ('sent_bytes_total', 'counter', 'Bytes written to clients',
+             self.bytes_sent),
+            ('tls_handshakes_total', 'counter', 'Completed TLS handshakes',
+             self.handshakes),
+            ('tls_resumed_handshakes_total', 'counter',
+             'TLS handshakes that resumed an earlier session',
+             self.resumed_handshakes),
+        ]
+        metrics.extend(extra)
+
+        lines = []
+        for name, kind, description, value in metrics:
+            name = 'httpserver_' + name
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            lines.append('{} {}'.format(name, value))
+        for key, description in self.HISTOGRAMS:
+            name = 'httpserver_{}_seconds'.format(key)
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} histogram'.format(name))
+            lines.extend(self.histograms[key].render(name))
+        return '\n'.join(lines) + '\n'
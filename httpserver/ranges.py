@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Byte ranges (RFC7233) for partial responses"""
+import binascii
+import os
+
+#: Requests for more ranges than this get the whole file
+MAX_RANGES = 16
+
+
+def parse_range(header, size):
+    """Parse a ``Range`` header for a file of size bytes
+
+    Returns a list of ``(first, last)`` byte positions, an empty list if none
+    of the ranges can be satisfied, or None if the header should be ignored.
+    Overlapping and adjacent ranges are merged (RFC7233 section 6.1).
+
+    >>> parse_range('bytes=0-499, -500', 10000)
+    [(0, 499), (9500, 9999)]
+    >>> parse_range('bytes=10-19, 0-9, 5-14', 100)
+    [(0, 19)]
+    >>> parse_range('bytes=500-', 100)
+    []
+    >>> parse_range('lines=1-2', 100) is None
+    True
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if not first:  # suffix range: the last bytes of the file
+                length = int(last)
+                if length < 0:
+                    return None
+                if length > 0 and size > 0:
+                    ranges.append((max(0, size - length), size - 1))
+                continue
+            first = int(first)
+            last = int(last) if last else None
+        except ValueError:
+            return None
+        if first < 0 or (last is not None and last < first):
+            return None
+        if first < size:
+            if last is None or last >= size:
+                last = size - 1
+            ranges.append((first, last))
+
+    ranges = _merge(ranges)
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def _merge(ranges):
+    """Merge overlapping and adjacent ranges"""
+    if len(ranges) < 2:
+        return ranges
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def range_segments(ranges, size, content_type):
+    """Get the headers and segments of a partial response
+
+    Segments are either bytes or ``(offset, count)`` spans of the file.
+    Multiple ranges are sent as ``multipart/byteranges``.
+
+    >>> range_segments([(0, 9)], 100, 'text/plain')
+    ({'Content-Range': 'bytes 0-9/100'}, [(0, 10)])
+    """
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        headers = {
+            'Content-Range': 'bytes {}-{}/{}'.format(first, last, size),
+        }
+        return headers, [(first, last - first + 1)]
+
+    boundary = binascii.hexlify(os.urandom(12)).decode()
+    segments = []
+    for first, last in ranges:
+        segments.append(
+            '--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n'
+            '\r\n'.format(boundary, content_type, first, last, size).encode())
+        segments.append((first, last - first + 1))
+        segments.append(b'\r\n')
+    segments.append('--{}--\r\n'.format(boundary).encode())
+
+    headers = {
+        'Content-Type': 'multipart/byteranges; boundary={}'.format(boundary),
+    }
+    return headers, segments
+
+
+def segments_length(segments):
+    """Get the total number of bytes in a list of segments"""
+    return sum(len(segment) if isinstance(segment, bytes) else segment[1]
+               for segment in segments)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""TLS contexts with session resumption, ALPN and SNI"""
+import ssl
+import time
+import weakref
+
+from .vhosts import HostTable
+
+
+#: Protocols offered with ALPN, this server only speaks HTTP/1.1
+ALPN_PROTOCOLS = ('http/1.1',)
+
+#: Ciphers allowed for TLS 1.2, with forward secrecy and AEAD only. The
+#: TLS 1.3 ciphers are all fine and aren't affected by this.
+CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20'
+
+#: Session tickets sent to a client after a full TLS 1.3 handshake
+NUM_TICKETS = 2
+
+
+def create_context(certfile, keyfile=None):
+    """Create a server context for a certificate
+
+    Session tickets are enabled, so clients can resume a session without a
+    full handshake. The tickets are encrypted with a key of the context,
+    so resuming works in every process that was forked after the context
+    was created.
+
+    Arguments:
+        certfile: the PEM file with the certificate chain
+        keyfile: the PEM file with the private key, if it isn't in certfile
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(CIPHERS)
+    context.options |= ssl.OP_NO_COMPRESSION
+    context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+    context.options &= ~ssl.OP_NO_TICKET
+    if hasattr(context, 'num_tickets'):  # Python 3.8
+        context.num_tickets = NUM_TICKETS
+    context.set_alpn_protocols(ALPN_PROTOCOLS)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+class Certificates(object):
+    """The certificates of a server, selected by the SNI server name
+
+    Clients that send no server name, or one without a certificate of its
+    own, get the default certificate. Names may be wildcards like
+    ``*.example.com``, as for :class:`HostTable`.
+
+    The time a handshake takes is measured from the ClientHello, when the
+    server name is looked at, until the connection is made.
+    """
+
+    def __init__(self, certfile, keyfile=None):
+        """Initialise with the default certificate"""
+        self.context = create_context(certfile, keyfile)
+        self.context.sni_callback = self._client_hello
+        self._names = HostTable()
+        self._started = weakref.WeakKeyDictionary()
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name, certfile, keyfile=None):
+        """Add the certificate for a server name"""
+        self._names.add(name, create_context(certfile, keyfile))
+
+    def _client_hello(self, ssl_object, server_name, context):
+        """Called by OpenSSL when a ClientHello was received"""
+        self._started[ssl_object] = time.perf_counter()
+        selected = self._names.get(server_name)
+        if selected is not None:
+            ssl_object.context = selected
+
+    def handshake_time(self, ssl_object):
+        """Get the seconds the handshake of a connection took, or None"""
+        started = self._started.pop(ssl_object, None)
+        if started is None:
+            return None
+        return time.perf_counter() - started
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Virtual hosts: the sites a server serves, by host name"""
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualHost(object):
+    """A site with its own document root"""
+
+    def __init__(self, folder, index=None):
+        """Initialise a virtual host
+
+        Arguments:
+            folder: the folder to serve files from
+            index: the :class:`PathIndex` of folder, if set only files in
+                the index are served
+        """
+        self.folder = folder
+        self.index = index
+
+    def __repr__(self):
+        return 'VirtualHost({!r})'.format(self.folder)
+
+
+class HostTable(object):
+    """Maps host names to virtual hosts
+
+    Names are either exact, or a wildcard like ``*.example.com`` that
+    matches every subdomain of ``example.com`` but not ``example.com``
+    itself. Exact names win over wildcards, and longer wildcards over
+    shorter ones. Hosts that match nothing get the default, if there is one.
+
+    The table is built once and shared by all connections. Names that were
+    matched against the wildcards are remembered, so a host is usually
+    found with a single lookup.
+
+    >>> hosts = HostTable()
+    >>> hosts.add('*.example.com', VirtualHost('/srv/example'))
+    >>> hosts.get('WWW.example.com.')
+    VirtualHost('/srv/example')
+    >>> hosts.get('example.com') is None
+    True
+    """
+
+    #: Most host names to remember the wildcard match of
+    MAX_REMEMBERED = 4096
+
+    def __init__(self, default=None):
+        """Initialise a table
+
+        Arguments:
+            default: the :class:`VirtualHost` for hosts that match nothing
+        """
+        self.default = default
+        self._hosts = dict()
+        self._wildcards = dict()  # suffix including the leading dot -> host
+        self._remembered = dict()
+
+    def __len__(self):
+        return len(self._hosts) + len(self._wildcards)
+
+    def add(self, name, host):
+        """Add a virtual host for a name, which may be a wildcard"""
+        name = _normalise(name)
+        if name.startswith('*.'):
+            self._wildcards[name[1:]] = host
+        else:
+            self._hosts[name] = host
+        self._remembered.clear()
+
+    def get(self, name):
+        """Get the virtual host for a host name, or None"""
+        if name is None:
+            return self.default
+        host = self._hosts.get(name)
+        if host is not None:
+            return host
+        host = self._remembered.get(name)
+        if host is not None:
+            return host
+
+        normalised = _normalise(name)
+        host = self._hosts.get(normalised)
+        dot = normalised.find('.')
+        while host is None and dot != -1:
+            host = self._wildcards.get(normalised[dot:])
+            dot = normalised.find('.', dot + 1)
+        if host is None:
+            host = self.default
+        if host is not None and len(self._remembered) < self.MAX_REMEMBERED:
+            self._remembered[name] = host
+        return host
+
+
+def _normalise(name):
+    """Host names are case-insensitive and may end with a dot"""
+    return name.lower().rstrip('.')
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Pre-forked worker processes"""
+import functools
+import logging
+import os
+import select
+import signal
+import socket
+import time
+
+
+logger = logging.getLogger(__name__)
+
+#: Workers that die within this many seconds are restarted with a delay
+MIN_LIFETIME = 1
+
+#: Give up after this many workers in a row die within MIN_LIFETIME
+MAX_FAILURES = 5
+
+#: Seconds a new generation of workers gets to start listening on a reload
+READY_TIMEOUT = 10
+
+
+def listen(bindaddr, port, backlog=100):
+    """Create a listening socket that can be shared with forked workers"""
+    family = socket.AF_INET6 if ':' in bindaddr else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((bindaddr, int(port)))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def _notify(fd):
+    """Tell the supervisor through a pipe that a worker is listening"""
+    if fd is not None:
+        os.write(fd, b'.')
+        os.close(fd)
+
+
+class Supervisor(object):
+    """Runs a number of worker processes and restarts them if they die
+
+    ``SIGTERM`` and ``SIGINT`` are passed on to the workers, after which the
+    supervisor waits for them to exit. ``SIGHUP`` starts a new generation of
+    workers and stops the old one once the new workers listen.
+    """
+
+    def __init__(self, count, target):
+        """Initialise a new supervisor
+
+        Arguments:
+            count: the number of workers to run
+            target: the function a worker process runs, it is passed a
+                ``ready`` function to call once it accepts connections
+        """
+        self.count = count
+        self.target = target
+        self.workers = dict()  # pid -> start time
+        self.retiring = set()  # workers of an old generation
+        self.stopping = False
+        self.reloading = False
+        self.failures = 0
+
+    def run(self):
+        """Start the workers and supervise them until they are stopped
+
+        Returns False if workers kept dying right after they were started.
+        """
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        for _ in range(self.count):
+            self._spawn()
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:  # pragma: no cover
+                break
+            started = self.workers.pop(pid, None)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if started is None or self.stopping:
+                continue
+
+            if os.WIFSIGNALED(status):
+                logger.warning('Worker %d was killed by signal %d',
+                               pid, os.WTERMSIG(status))
+            else:
+                logger.warning('Worker %d exited with status %d',
+                               pid, os.WEXITSTATUS(status))
+
+            if time.monotonic() - started >= MIN_LIFETIME:
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.failures >= MAX_FAILURES:
+                    logger.error('Workers keep dying on startup, stopping')
+                    self._handle_signal(signal.SIGTERM, None)
+                    continue
+                # back off exponentially
+                time.sleep(MIN_LIFETIME * 2 ** (self.failures - 1))
+            if not self.stopping:
+                self._spawn()
+
+        return self.failures < MAX_FAILURES
+
+    def reload(self):
+        """Replace all workers by a new generation
+
+        The old workers are sent ``SIGTERM`` once every new worker accepts
+        connections, so there always are workers listening. If the new
+        workers don't start in time, they are stopped instead.
+        Returns whether the workers were replaced.
+        """
+        old = [pid for pid in self.workers if pid not in self.retiring]
+        logger.info('Starting a new generation of %d workers', self.count)
+        pipes = dict()
+        for _ in range(self.count):
+            pid, fd = self._spawn(wait=True)
+            pipes[fd] = pid
+
+        deadline = time.monotonic() + READY_TIMEOUT
+        ready = 0
+        while pipes and time.monotonic() < deadline:
+            readable, _, _ = select.select(
+                list(pipes), [], [], deadline - time.monotonic())
+            for fd in readable:
+                ready += len(os.read(fd, 1))
+                os.close(fd)
+                del pipes[fd]
+        for fd in pipes:
+            os.close(fd)
+
+        replaced = ready == self.count
+        if not replaced:
+            logger.error('New workers failed to start, keeping the old ones')
+            old = [pid for pid in self.workers
+                   if pid not in old and pid not in self.retiring]
+        self.retiring.update(old)
+        for pid in old:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:  # pragma: no cover
+                pass
+        return replaced
+
+    def _spawn(self, wait=False):
+        """Fork a new worker
+
+        If wait is true, returns the pid and a pipe that becomes readable
+        once the worker accepts connections.
+        """
+        read_fd = write_fd = None
+        if wait:
+            read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            if read_fd is not None:
+                os.close(read_fd)
+            status = 0
+            try:
+                self.target(ready=functools.partial(_notify, write_fd))
+            except BaseException:
+                logger.exception('Worker %d failed', os.getpid())
+                status = 1
+            finally:
+                os._exit(status)
+
+        logger.info('Started worker %d', pid)
+        self.workers[pid] = time.monotonic()
+        if wait:
+            os.close(write_fd)
+            return pid, read_fd
+
+    def _handle_reload(self, signum, frame):
+        """Reload the workers, unless they are being stopped"""
+        if self.stopping or self.reloading:
+            return
+        self.reloading = True
+        try:
+            self.reload()
+        finally:
+            self.reloading = False
+
+    def _handle_signal(self, signum, frame):
+        """Pass the signal on to all workers"""
+        logger.info('Stopping workers')
+        self.stopping = True
+        for pid in self.workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:  # pragma: no cover
+                pass
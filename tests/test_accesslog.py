@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_accesslog
+----------------------------------
+
+Tests for `httpserver.accesslog` module.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from httpserver.accesslog import AccessLog, format_entry
+from httpserver.messages import Request
+
+REQUEST = Request('GET', '/index.html', 'HTTP/1.1')
+REQUEST.headers.add(b'User-Agent', b'Agent "007"')
+
+
+class TestAccessLog(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'access.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _read(self, filename=None):
+        with open(filename or self.filename) as f:
+            return f.read().splitlines()
+
+    def test_common(self):
+        line = format_entry((1e9, '::1', REQUEST, 200, None), 'common')
+        assert line == ('::1 - - [09/Sep/2001:01:46:40 +0000] '
+                        '"GET /index.html HTTP/1.1" 200 -')
+
+    def test_combined(self):
+        line = format_entry((1e9, None, None, 400, 11), 'combined')
+        assert line == ('- - - [09/Sep/2001:01:46:40 +0000] "-" 400 11 '
+                        '"-" "-"')
+        line = format_entry((1e9, '::1', REQUEST, 200, 5), 'combined')
+        assert line.endswith(' 200 5 "-" "Agent \\"007\\""')
+
+    def test_json(self):
+        line = format_entry((1e9, '::1', REQUEST, 304, 0), 'json')
+        assert json.loads(line) == {
+            'time': 1e9,
+            'host': '::1',
+            'request': 'GET /index.html HTTP/1.1',
+            'status': 304,
+            'length': 0,
+            'referer': None,
+            'user_agent': 'Agent "007"',
+        }
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            AccessLog(self.filename, log_format='apache')
+
+    def test_batches(self):
+        access_log = AccessLog(self.filename, interval=60)
+        access_log.start()
+        for code in (200, 404):
+            access_log.log('::1', REQUEST, code, 5)
+        # nothing is written until the next batch
+        assert self._read() == []
+        access_log.close()
+        assert [line.split('" ')[1] for line in self._read()] == [
+            '200 5', '404 5']
+
+    def test_dropped(self):
+        access_log = AccessLog(self.filename, max_pending=2)
+        for _ in range(3):
+            access_log.log('::1', REQUEST, 200, 5)
+        assert access_log.dropped == 1
+
+    def test_rotate(self):
+        access_log = AccessLog(self.filename, max_size=50, backups=2)
+        access_log._open()
+        for _ in range(4):
+            access_log.log('::1', REQUEST, 200, 5)
+            access_log._write_batch()
+        access_log.close()
+
+        assert len(self._read(self.filename + '.1')) == 1
+        assert len(self._read(self.filename + '.2')) == 1
+        assert not os.path.exists(self.filename + '.3')
+        assert self._read() == []
+
+
+if __name__ == '__main__':
+    unittest.main()
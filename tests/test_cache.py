@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `httpserver.cache` module.
+"""
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from httpserver.cache import CacheEntry, FileCache
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _entry(self, name, content=b'content'):
+        """Write a file and get a cache entry for it"""
+        filename = os.path.join(self.folder, name)
+        with open(filename, 'wb') as f:
+            f.write(content)
+        return CacheEntry(filename, os.stat(filename), 'etag', 'text/plain',
+                          content)
+
+    def test_hit_and_miss(self):
+        cache = FileCache()
+        entry = self._entry('a')
+        assert cache.get('a') is None
+        cache.put('a', entry)
+        assert cache.get('a') is entry
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_evict_least_recently_used(self):
+        cache = FileCache(max_entries=2)
+        for name in 'abc':
+            cache.put(name, self._entry(name))
+            cache.get('a')
+        assert cache.get('a') is not None
+        assert cache.get('b') is None
+        assert cache.get('c') is not None
+        assert cache.evictions == 1
+
+    def test_evict_by_size(self):
+        cache = FileCache(max_size=10)
+        cache.put('a', self._entry('a', b'x' * 6))
+        cache.put('b', self._entry('b', b'x' * 6))
+        assert len(cache) == 1
+        assert cache.size == 6
+        assert cache.get('b') is not None
+
+        cache.put('c', self._entry('c', b'x' * 11))
+        assert cache.get('c') is None
+
+    def test_changed_file(self):
+        cache = FileCache()
+        cache.put('a', self._entry('a'))
+        self._entry('a', b'changed content')
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    def test_deleted_file(self):
+        cache = FileCache()
+        cache.put('a', self._entry('a'))
+        os.unlink(os.path.join(self.folder, 'a'))
+        assert cache.get('a') is None
+
+    def test_check_interval(self):
+        cache = FileCache(check_interval=60)
+        entry = self._entry('a')
+        cache.put('a', entry)
+        self._entry('a', b'changed content')
+        assert cache.get('a') is entry
+
+    def test_evicted_mmap_closed(self):
+        cache = FileCache(max_entries=1)
+        entry = self._entry('a')
+        with open(entry.filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        cache.put('a', entry.variant('etag', mapped))
+
+        view = memoryview(mapped)
+        cache.put('b', self._entry('b'))
+        # still in use, so it is unmapped when it is released
+        assert not mapped.closed
+        view.release()
+
+        cache.put('a', entry.variant('etag', mapped))
+        cache.clear()
+        assert mapped.closed
+
+    def test_variant_checked_against_known(self):
+        cache = FileCache()
+        entry = self._entry('a')
+        cache.put('a.gz', entry.variant('etag-gzip', b'gz', 'gzip'))
+        with mock.patch('os.stat') as stat:
+            assert cache.get('a.gz', known=entry).body == b'gz'
+        assert not stat.called
+
+        changed = self._entry('a', b'changed content')
+        assert cache.get('a.gz', known=changed) is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_connections
+----------------------------------
+
+Tests for `httpserver.connections` module.
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+from httpserver.connections import ConnectionManager
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = mock.Mock()
+        self.loop.time.return_value = 0
+        self.manager = ConnectionManager(self.loop, max_connections=2)
+
+    def test_unknown_action(self):
+        with self.assertRaises(ValueError):
+            ConnectionManager(self.loop, when_full='drop')
+
+    def test_limit(self):
+        first, second, third = mock.Mock(), mock.Mock(), mock.Mock()
+        assert self.manager.add(first)
+        assert self.manager.add(second)
+        assert self.manager.full
+        assert not self.manager.add(third)
+        assert self.manager.rejected == 1
+        self.manager.remove(first)
+        assert not self.manager.full
+        assert len(self.manager) == 1
+
+    def test_no_limit(self):
+        manager = ConnectionManager(self.loop)
+        for _ in range(100):
+            assert manager.add(mock.Mock())
+        assert not manager.full
+
+    def test_wait(self):
+        manager = ConnectionManager(self.loop, max_connections=1,
+                                    when_full='wait')
+        first, second, third = mock.Mock(), mock.Mock(), mock.Mock()
+        manager.add(first)
+        assert not manager.add(second)
+        assert not manager.add(third)
+        assert manager.waiting == 2
+        assert manager.rejected == 0
+
+        # A waiting connection that is closed is forgotten
+        manager.remove(third)
+        assert manager.waiting == 1
+        manager.remove(first)
+        second._admit.assert_called_once_with()
+        assert manager.waiting == 0
+        assert len(manager) == 1
+        assert not third._admit.called
+
+    def test_idle(self):
+        busy, idle = mock.Mock(idle=False), mock.Mock(idle=True)
+        self.manager.add(busy)
+        self.manager.add(idle)
+        assert self.manager.idle() == [idle]
+
+    def test_single_timer(self):
+        """Many timeouts share one timer"""
+        protocols = [mock.Mock() for _ in range(10)]
+        for protocol in protocols:
+            self.manager.touch(protocol, 15)
+        self.loop.call_at.assert_called_once_with(1, self.manager._advance)
+
+    def test_timeout(self):
+        protocol, other = mock.Mock(), mock.Mock()
+        self.manager.touch(protocol, 3)
+        self.manager.touch(other, 5)
+
+        self.loop.time.return_value = 2.5
+        self.manager._advance()
+        assert not protocol._handle_timeout.called
+
+        self.loop.time.return_value = 3
+        self.manager._advance()
+        protocol._handle_timeout.assert_called_once_with()
+        assert not other._handle_timeout.called
+
+    def test_touch_extends(self):
+        protocol = mock.Mock()
+        self.manager.touch(protocol, 3)
+        self.loop.time.return_value = 2
+        self.manager.touch(protocol, 3)
+        self.loop.time.return_value = 4
+        self.manager._advance()
+        assert not protocol._handle_timeout.called
+        self.loop.time.return_value = 5
+        self.manager._advance()
+        protocol._handle_timeout.assert_called_once_with()
+
+    def test_late_timer(self):
+        """Ticks that were skipped by a late timer still time out"""
+        protocol = mock.Mock()
+        self.manager.touch(protocol, 3)
+        self.loop.time.return_value = 10
+        self.manager._advance()
+        protocol._handle_timeout.assert_called_once_with()
+
+    def test_timeout_beyond_wheel(self):
+        """Timeouts longer than a round of the wheel wait another round"""
+        manager = ConnectionManager(self.loop, slots=4)
+        protocol = mock.Mock()
+        manager.touch(protocol, 6)
+        for now in range(1, 6):
+            self.loop.time.return_value = now
+            manager._advance()
+        assert not protocol._handle_timeout.called
+        self.loop.time.return_value = 6
+        manager._advance()
+        protocol._handle_timeout.assert_called_once_with()
+
+    def test_remove_forgets_timeout(self):
+        protocol = mock.Mock()
+        self.manager.add(protocol)
+        self.manager.touch(protocol, 3)
+        self.manager.remove(protocol)
+        self.loop.time.return_value = 3
+        self.manager._advance()
+        assert not protocol._handle_timeout.called
+        # The timer stops when no timeouts are left
+        assert self.manager._timer is None
+
+
+class TestDrain(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.manager = ConnectionManager(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_drain(self):
+        idle, busy = mock.Mock(), mock.Mock()
+        idle.shutdown.side_effect = lambda: self.manager.remove(idle)
+        self.manager.add(idle)
+        self.manager.add(busy)
+        self.loop.call_later(0.01, self.manager.remove, busy)
+        assert self.loop.run_until_complete(self.manager.drain(5)) == 0
+        busy.shutdown.assert_called_once_with()
+        assert not busy.transport.abort.called
+
+    def test_drain_timeout(self):
+        busy = mock.Mock()
+        self.manager.add(busy)
+        assert self.loop.run_until_complete(self.manager.drain(0.01)) == 1
+        busy.transport.abort.assert_called_once_with()
+        # Removing it afterwards is fine
+        self.manager.remove(busy)
+
+    def test_drain_waiting(self):
+        """Connections that wait for a slot are shut down as well"""
+        manager = ConnectionManager(self.loop, max_connections=1,
+                                    when_full='wait')
+        active, waiting = mock.Mock(), mock.Mock()
+        active.shutdown.side_effect = lambda: manager.remove(active)
+        waiting.shutdown.side_effect = lambda: manager.remove(waiting)
+        manager.add(active)
+        manager.add(waiting)
+        assert self.loop.run_until_complete(manager.drain(5)) == 0
+        assert waiting.shutdown.called
+        assert not waiting._admit.called
+
+
+if __name__ == '__main__':
+    unittest.main()
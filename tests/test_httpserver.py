@@ -7,13 +7,28 @@ test_httpserver
 
 Tests for `httpserver` module.
 """
+import asyncio
+import concurrent.futures
+import gzip
 import os
+import shutil
+import tempfile
 import unittest
 import hashlib
+import logging
+import threading
 from unittest import mock
 from freezegun import freeze_time
 
+from httpserver.accesslog import AccessLog
+from httpserver.cache import FileCache
+from httpserver.compression import gzip_compress
+from httpserver.connections import ConnectionManager
 from httpserver.httpserver import HttpProtocol
+from httpserver.index import PathIndex
+from httpserver.manifest import Manifest
+from httpserver.messages import Response
+from httpserver.vhosts import HostTable, VirtualHost
 
 
 class TestHttpserver(unittest.TestCase):
@@ -126,6 +141,109 @@ class TestHttpserver(unittest.TestCase):
 
         assert head.startswith(b'HTTP/1.1 404 Not Found\r\n')
 
+    def test_no_traversal(self):
+        """Files outside the folder are never served"""
+        for target in ['/../test_httpserver.py',
+                       '/%2e%2e/test_httpserver.py',
+                       '/no_index_dir/../../test_httpserver.py']:
+            self.httpprotocol.data_received(
+                'GET {} HTTP/1.1\r\n\r\n'.format(target).encode())
+            head, body = self._sent().split(b'\r\n\r\n', 1)
+            assert head.startswith(b'HTTP/1.1 404 Not Found\r\n'), target
+
+    def test_index(self):
+        """With an index, only indexed files are served"""
+        index = PathIndex(self.fixtures_location)
+        index.scan()
+        self.httpprotocol = HttpProtocol('localhost', self.fixtures_location,
+                                         event_loop=mock.Mock(), index=index)
+        self.httpprotocol.connection_made(self.transport)
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_persistent.crlf'))
+        assert self._sent().startswith(b'HTTP/1.1 200 OK\r\n')
+
+        index._paths.clear()
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_persistent.crlf'))
+        assert self._sent().startswith(b'HTTP/1.1 404 Not Found\r\n')
+
+    def test_virtual_hosts(self):
+        """Each host is served from its own folder"""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with open(os.path.join(folder, 'index.html'), 'wb') as f:
+            f.write(b'other site')
+        hosts = HostTable()
+        hosts.add('localhost', VirtualHost(self.fixtures_location))
+        hosts.add('*.example.com', VirtualHost(folder))
+        self.httpprotocol = HttpProtocol('localhost', self.fixtures_location,
+                                         event_loop=mock.Mock(), hosts=hosts)
+        self.httpprotocol.connection_made(self.transport)
+
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.1\r\nHost: www.example.com\r\n\r\n')
+        assert self._sent().endswith(b'\r\n\r\nother site')
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.1\r\nHost: localhost:8080\r\n\r\n')
+        assert self._sent().endswith(self._read_fixture('index.html'))
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.1\r\nHost: example.org\r\n\r\n')
+        assert self._sent().startswith(b'HTTP/1.1 404 Not Found\r\n')
+
+        hosts.default = hosts.get('www.example.com')
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.1\r\nHost: example.org\r\n\r\n')
+        assert self._sent().endswith(b'\r\n\r\nother site')
+
+    def test_metrics(self):
+        """Metrics are served without touching the file system"""
+        self.httpprotocol._metrics_path = '/__metrics'
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_persistent.crlf'))
+        self._sent()
+
+        with mock.patch('os.stat') as stat:
+            self.httpprotocol.data_received(
+                b'GET /__metrics HTTP/1.1\r\n\r\n')
+        assert not stat.called
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert b'Content-Type: text/plain; version=0.0.4\r\n' in head
+        assert b'\nhttpserver_requests_total 2\n' in body
+        assert b'\nhttpserver_keepalive_reuses_total 1\n' in body
+        assert b'\nhttpserver_active_connections 1\n' in body
+        assert b'\nhttpserver_parse_seconds_count 2\n' in body
+        assert b'\nhttpserver_lookup_seconds_count 1\n' in body
+        assert b'\nhttpserver_cache_misses_total 1\n' in body
+
+    def test_access_log(self):
+        self.transport.get_extra_info = mock.Mock(
+            return_value=('127.0.0.1', 1234))
+        access_log = mock.Mock(spec=AccessLog)
+        self.httpprotocol._access_log = access_log
+        self.httpprotocol.connection_made(self.transport)
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_persistent.crlf') +
+            b'GET /missing HTTP/1.1\r\n\r\nGET\r\n\r\n')
+
+        index = self._read_fixture('index.html')
+        calls = [c[0] for c in access_log.log.call_args_list]
+        assert [(peer, request and request.target, code, length)
+                for peer, request, code, length in calls] == [
+            ('127.0.0.1', '/index.html', 200, len(index)),
+            ('127.0.0.1', '/missing', 404, 9),
+            ('127.0.0.1', None, 400, 11),
+        ]
+
+    def test_no_logger_per_connection(self):
+        """Connections don't register loggers that are never released"""
+        loggers = len(logging.Logger.manager.loggerDict)
+        for _ in range(3):
+            protocol = HttpProtocol('localhost', self.fixtures_location,
+                                    event_loop=mock.Mock())
+            protocol.connection_made(self.transport)
+        assert len(logging.Logger.manager.loggerDict) == loggers
+
     def test_get_persistent(self):
         """Try and get index.html over the same connection"""
         data = self._read_fixture('get_index_persistent.crlf')
@@ -165,8 +283,31 @@ class TestHttpserver(unittest.TestCase):
             assert b'Date: ' in head
             assert b'Date: Sat, 14 Mar 2015 09:26:53 +0000' in head
 
+    def test_single_write(self):
+        """The head and body of a response are written at once"""
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_named.crlf'))
+        assert self.transport.write.call_count == 1
+
+    def test_date_header_cached(self):
+        """The Date header is only formatted once per second"""
+        data = self._read_fixture('get_index_persistent.crlf')
+        with freeze_time("2015-03-14 09:26:53", tz_offset=0):
+            self.httpprotocol.data_received(data)
+            with mock.patch('time.strftime') as strftime:
+                self.httpprotocol.data_received(data)
+                assert not strftime.called
+        with freeze_time("2015-03-14 09:26:54", tz_offset=0):
+            self.httpprotocol.data_received(data)
+        response = self._sent()
+        assert response.count(b'Date: Sat, 14 Mar 2015 09:26:53 +0000') == 2
+        assert response.count(b'Date: Sat, 14 Mar 2015 09:26:54 +0000') == 1
+
     def test_get_with_etag(self):
-        """Test GET /index.html"""
+        """Test GET /index.html with ETags from the SHA-1 hash"""
+        self.httpprotocol = HttpProtocol('localhost', self.fixtures_location,
+                                         event_loop=mock.Mock(), etag='sha1')
+        self.httpprotocol.connection_made(self.transport)
         request = self._read_fixture('get_index_named.crlf')
         index = self._read_fixture('index.html')
         self.httpprotocol.data_received(request)
@@ -194,6 +335,162 @@ class TestHttpserver(unittest.TestCase):
         assert b'Date: ' in head
         assert 'Etag: "{}"'.format(etag).encode('utf-8') in head
 
+    def test_get_with_stat_etag(self):
+        """By default the ETag is generated from stat"""
+        stat = os.stat(os.path.join(self.fixtures_location, 'index.html'))
+        etag = '"{:x}-{:x}-{:x}"'.format(stat.st_ino, stat.st_size,
+                                         stat.st_mtime_ns).encode()
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_persistent.crlf'))
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert b'Etag: ' + etag in head
+
+        # Revalidation only stats the file
+        with mock.patch('builtins.open') as patched_open:
+            self.httpprotocol.data_received(
+                b'GET /index.html HTTP/1.1\r\nIf-None-Match: ' + etag +
+                b'\r\n\r\n')
+            assert not patched_open.called
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 304 Not Modified\r\n')
+
+    def test_unknown_etag_strategy(self):
+        with self.assertRaises(ValueError):
+            HttpProtocol('localhost', self.fixtures_location,
+                         event_loop=mock.Mock(), etag='md5')
+
+    def test_range(self):
+        """Get part of a file"""
+        index = self._read_fixture('index.html')
+        self.httpprotocol.data_received(
+            b'GET /index.html HTTP/1.1\r\nRange: bytes=10-19\r\n\r\n')
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 206 Partial Content\r\n')
+        assert 'Content-Range: bytes 10-19/{}'.format(
+            len(index)).encode() in head
+        assert b'Content-Length: 10\r\n' in head
+        assert body == index[10:20]
+
+    def test_range_not_satisfiable(self):
+        index = self._read_fixture('index.html')
+        self.httpprotocol.data_received(
+            b'GET /index.html HTTP/1.1\r\nRange: bytes=1000-\r\n\r\n')
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(
+            b'HTTP/1.1 416 Requested Range Not Satisfiable\r\n')
+        assert 'Content-Range: bytes */{}'.format(len(index)).encode() in head
+        assert body == b''
+        assert not self.transport.close.called
+
+    def test_multiple_ranges(self):
+        index = self._read_fixture('index.html')
+        self.httpprotocol.data_received(
+            b'GET /index.html HTTP/1.1\r\nRange: bytes=0-4,-5\r\n\r\n')
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 206 Partial Content\r\n')
+        assert b'Content-Type: multipart/byteranges; boundary=' in head
+        assert 'Content-Length: {}'.format(len(body)).encode() in head
+        assert b'\r\n\r\n' + index[:5] + b'\r\n--' in body
+        assert b'\r\n\r\n' + index[-5:] + b'\r\n--' in body
+
+    def test_if_range(self):
+        """Changed files are sent whole if If-Range is sent"""
+        self.httpprotocol.data_received(
+            b'GET /index.html HTTP/1.1\r\nRange: bytes=0-4\r\n'
+            b'If-Range: "outdated"\r\n\r\n')
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert b'Accept-Ranges: bytes\r\n' in head
+        assert body == self._read_fixture('index.html')
+
+    def test_header_case(self):
+        """Header names and connection options are case-insensitive"""
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.0\r\nconnection: keep-alive\r\n\r\n')
+        assert b'\r\nKeep-Alive: timeout=15\r\n' in self._sent()
+        assert not self.transport.close.called
+
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.1\r\nHOST: localhost\r\n'
+            b'CONNECTION: Close\r\n\r\n')
+        assert self._sent().startswith(b'HTTP/1.1 200 OK\r\n')
+        assert self.transport.close.called
+
+    def test_head(self):
+        """HEAD is answered from the stat of a file, without a body"""
+        index = self._read_fixture('index.html')
+        with mock.patch('builtins.open') as patched_open:
+            self.httpprotocol.data_received(
+                b'HEAD / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        assert not patched_open.called
+        response = self._sent()
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert response.endswith(b'\r\n\r\n')
+        assert 'Content-Length: {}\r\n'.format(
+            len(index)).encode() in response
+        assert b'\r\nLast-Modified: ' in response
+        assert b'\r\nEtag: ' in response
+
+        # A cached file is answered from the cache
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_persistent.crlf'))
+        self._sent()
+        self.httpprotocol.data_received(
+            b'HEAD / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        assert self._sent() == response
+
+    def test_head_error(self):
+        """Errors for HEAD requests have no body either"""
+        self.httpprotocol.data_received(
+            b'HEAD /nothing.html HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'GET /nothing.html HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        head, rest = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 404 Not Found\r\n')
+        assert rest.startswith(b'HTTP/1.1 404 Not Found\r\n')
+
+    def test_head_sha1(self):
+        """With SHA-1 ETags, the file is read, but not sent"""
+        self.httpprotocol._etag = 'sha1'
+        self.httpprotocol.data_received(
+            b'HEAD / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = self._sent()
+        index = self._read_fixture('index.html')
+        assert response.endswith(b'\r\n\r\n')
+        assert 'Etag: "{}"'.format(
+            hashlib.sha1(index).hexdigest()).encode() in response
+
+    def test_if_modified_since(self):
+        """Unmodified files are answered with 304 from their stat"""
+        with mock.patch('builtins.open') as patched_open:
+            self.httpprotocol.data_received(
+                b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+                b'If-Modified-Since: Fri, 01 Jan 2100 00:00:00 GMT\r\n\r\n')
+        assert not patched_open.called
+        head = self._sent()
+        assert head.startswith(b'HTTP/1.1 304 Not Modified\r\n')
+        assert b'\r\nLast-Modified: ' in head
+
+        # a modified file is sent, and after that answered from the cache
+        for _ in range(2):
+            self.httpprotocol.data_received(
+                b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+                b'If-Modified-Since: Thu, 01 Jan 1970 00:00:00 GMT\r\n\r\n')
+            head, body = self._sent().split(b'\r\n\r\n', 1)
+            assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+            assert body == self._read_fixture('index.html')
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+            b'If-Modified-Since: Fri, 01 Jan 2100 00:00:00 GMT\r\n\r\n')
+        assert self._sent().startswith(b'HTTP/1.1 304 Not Modified\r\n')
+
+    def test_if_modified_since_with_etag(self):
+        """If-None-Match goes before If-Modified-Since"""
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+            b'If-None-Match: "something else"\r\n'
+            b'If-Modified-Since: Fri, 01 Jan 2100 00:00:00 GMT\r\n\r\n')
+        assert self._sent().startswith(b'HTTP/1.1 200 OK\r\n')
+
     def test_send_keepalive(self):
         """Send a lower keepalive"""
         request = self._read_fixture('get_keepalive_2.crlf')
@@ -212,6 +509,88 @@ class TestHttpserver(unittest.TestCase):
         assert b'timeout=15' in head
         assert self.httpprotocol._timeout == 15
 
+    def test_split_request(self):
+        """Requests may arrive in several pieces"""
+        data = self._read_fixture('get_index_named.crlf')
+        for i in range(len(data) - 1):
+            self.httpprotocol.data_received(data[i:i + 1])
+            assert not self.transport.write.called
+        self.httpprotocol.data_received(data[-1:])
+
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert body == self._read_fixture('index.html')
+
+    def test_pipelined_requests(self):
+        """All requests in one piece of data are answered in order"""
+        data = (self._read_fixture('get_index_persistent.crlf') +
+                self._read_fixture(
+                    'no_index_dir/get_directory_without_index.crlf'))
+        self.httpprotocol.data_received(data)
+
+        response = self._sent()
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        first, second = response.split(b'HTTP/1.1 404 Not Found\r\n')
+        assert first.endswith(self._read_fixture('index.html'))
+        assert self.transport.close.called
+
+    def test_paused_pipelined_requests(self):
+        """Queued responses wait until the transport has drained"""
+        self.transport = mock.MagicMock(
+            spec=['write', 'close', 'pause_reading', 'resume_reading',
+                  'set_write_buffer_limits'])
+        self.httpprotocol = HttpProtocol(
+            'localhost', self.fixtures_location, event_loop=mock.Mock(),
+            high_water=1024, low_water=256)
+        self.httpprotocol.connection_made(self.transport)
+        self.transport.set_write_buffer_limits.assert_called_once_with(
+            1024, 256)
+
+        self.transport.write.side_effect = (
+            lambda data: self.httpprotocol.pause_writing())
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_persistent.crlf') * 2)
+        assert self.transport.write.call_count == 1
+        assert self.transport.pause_reading.called
+
+        self.transport.write.side_effect = None
+        self.httpprotocol.resume_writing()
+        assert self.transport.resume_reading.called
+        assert self._sent().count(b'HTTP/1.1 200 OK\r\n') == 2
+
+    def test_request_body_skipped(self):
+        """The body of a request is not mistaken for the next request"""
+        self.httpprotocol.data_received(
+            b'GET / HTTP/1.1\r\nContent-Length: 16\r\n\r\nGET / HTTP/1.1')
+        self.httpprotocol.data_received(
+            b'\r\n\r\n' + self._read_fixture('get_index_named.crlf'))
+
+        response = self._sent()
+        assert response.count(b'HTTP/1.1 200 OK\r\n') == 2
+        assert self.transport.close.called
+
+    def test_headers_too_large(self):
+        """We don't buffer endless headers"""
+        self.httpprotocol.data_received(b'GET / HTTP/1.1\r\n')
+        self.httpprotocol.data_received(b'X-Large: ' + b'a' * 2 ** 17)
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(
+            b'HTTP/1.1 431 Request Header Fields Too Large\r\n')
+        assert self.transport.close.called
+
+    def test_cached(self):
+        """The second request is served from the cache"""
+        data = self._read_fixture('get_index_persistent.crlf')
+        self.httpprotocol.data_received(data)
+        self._sent()
+        with mock.patch('builtins.open') as patched_open:
+            self.httpprotocol.data_received(data)
+            assert not patched_open.called
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert body == self._read_fixture('index.html')
+        assert self.httpprotocol._cache.hits == 1
+
     def test_timeout(self):
         """Test timing out"""
         assert not self.transport.close.called
@@ -221,6 +600,13 @@ class TestHttpserver(unittest.TestCase):
         self.httpprotocol._handle_timeout()
         assert self.transport.close.called
 
+    def test_timeout_while_sending(self):
+        """A response that is still being sent isn't cut off"""
+        self.httpprotocol._sending = mock.Mock()
+        self.httpprotocol._handle_timeout()
+        assert not self.transport.close.called
+        assert self.httpprotocol._timeout_handle is not None
+
     def test_timeout_request(self):
         data = self._read_fixture('get_index_persistent.crlf')
         self.httpprotocol.data_received(data)
@@ -229,6 +615,495 @@ class TestHttpserver(unittest.TestCase):
         self.httpprotocol._handle_timeout()
         assert self.transport.close.called
 
+    def test_timeout_extended(self):
+        """Requests don't reschedule the timer, it checks when it fires"""
+        loop = self.httpprotocol._loop
+        handle = self.httpprotocol._timeout_handle
+        loop.time.return_value = 10
+        self.httpprotocol.data_received(
+            self._read_fixture('get_index_persistent.crlf'))
+        assert self.httpprotocol._timeout_handle is handle
+        loop.call_later.reset_mock()
+
+        loop.time.return_value = 20
+        self.httpprotocol._check_timeout()
+        assert not self.transport.close.called
+        loop.call_later.assert_called_once_with(
+            5, self.httpprotocol._check_timeout)
+
+        loop.time.return_value = 25
+        self.httpprotocol._check_timeout()
+        assert self.transport.close.called
+
+    def test_shutdown(self):
+        """Idle connections are closed at once when shutting down"""
+        self.transport.pause_reading = mock.Mock()
+        self.httpprotocol.shutdown()
+        assert self.transport.pause_reading.called
+        assert self.transport.close.called
+
+    def test_shutdown_while_sending(self):
+        """Responses that are queued are sent before closing"""
+        self.transport.pause_reading = mock.Mock()
+        self.httpprotocol._sending = mock.Mock()
+        self.httpprotocol._outgoing.append(Response(body=b'last'))
+        self.httpprotocol.shutdown()
+        assert not self.transport.close.called
+
+        self.httpprotocol._sending = None
+        self.httpprotocol._flush()
+        head, body = self._sent().split(b'\r\n\r\n', 1)
+        assert b'\r\nConnection: close\r\n' in head
+        assert body == b'last'
+        assert self.transport.close.called
+
+    def test_too_many_connections(self):
+        """Connections beyond the limit are rejected with 503"""
+        loop = mock.Mock(**{'time.return_value': 0})
+        connections = ConnectionManager(loop, max_connections=1)
+        connections.add(mock.Mock())
+        protocol = HttpProtocol('localhost', self.fixtures_location,
+                                event_loop=loop,
+                                connections=connections)
+        protocol.connection_made(self.transport)
+        assert self._sent().startswith(
+            b'HTTP/1.1 503 Service Unavailable\r\n')
+        assert self.transport.close.called
+        assert connections.rejected == 1
+
+    def test_wait_for_connection(self):
+        """Connections beyond the limit may wait instead"""
+        loop = mock.Mock(**{'time.return_value': 0})
+        connections = ConnectionManager(loop, max_connections=1,
+                                        when_full='wait')
+        first = mock.Mock()
+        connections.add(first)
+        transport = mock.Mock()
+        protocol = HttpProtocol('localhost', self.fixtures_location,
+                                event_loop=loop,
+                                connections=connections)
+        protocol.connection_made(transport)
+        assert transport.pause_reading.called
+        assert not transport.write.called
+
+        connections.remove(first)
+        assert transport.resume_reading.called
+        assert len(connections) == 1
+        protocol.connection_lost(None)
+        assert len(connections) == 0
+
+
+class TestHttpserverCompression(unittest.TestCase):
+    """Test compressed responses"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.script = b'function hello() { return "hello"; }\n' * 100
+        self._write('script.js', self.script)
+        self._write('style.css', b'body { color: red; }\n' * 100)
+        self._write('style.css.gz', b'precompressed')
+        self._write('image.png', b'\x89PNG' * 100)
+        self.httpprotocol = HttpProtocol('localhost', self.folder,
+                                         event_loop=mock.Mock())
+        self.transport = mock.MagicMock(spec=['write', 'close'])
+        self.httpprotocol.connection_made(self.transport)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.folder, name), 'wb') as f:
+            f.write(content)
+
+    def _get(self, path, *headers):
+        """Request path and return the head and body of the response"""
+        request = '\r\n'.join(('GET {} HTTP/1.1'.format(path),) + headers)
+        self.httpprotocol.data_received(request.encode() + b'\r\n\r\n')
+        response = b''.join(c[0][0]
+                            for c in self.transport.write.call_args_list)
+        self.transport.write.reset_mock()
+        return response.split(b'\r\n\r\n', 1)
+
+    def test_compress(self):
+        head, body = self._get('/script.js', 'Accept-Encoding: gzip, br')
+        assert b'Content-Encoding: gzip\r\n' in head
+        assert b'Vary: Accept-Encoding\r\n' in head
+        assert 'Content-Length: {}'.format(len(body)).encode() in head
+        assert gzip.decompress(body) == self.script
+
+        # The compressed version is cached
+        assert self._get('/script.js', 'Accept-Encoding: gzip')[1] == body
+        assert self.httpprotocol._compressed_cache.hits == 1
+
+    def test_not_accepted(self):
+        for headers in [(), ('Accept-Encoding: gzip;q=0, deflate',)]:
+            head, body = self._get('/script.js', *headers)
+            assert b'Content-Encoding' not in head
+            assert b'Vary: Accept-Encoding\r\n' in head
+            assert body == self.script
+
+    def test_etag_per_encoding(self):
+        head, _ = self._get('/script.js')
+        etag = head.split(b'Etag: ', 1)[1].split(b'\r\n')[0]
+        head, _ = self._get('/script.js', 'Accept-Encoding: gzip')
+        gzip_etag = head.split(b'Etag: ', 1)[1].split(b'\r\n')[0]
+        assert etag != gzip_etag
+
+        head, _ = self._get('/script.js', 'Accept-Encoding: gzip',
+                            'If-None-Match: ' + gzip_etag.decode())
+        assert head.startswith(b'HTTP/1.1 304 Not Modified\r\n')
+        assert b'Vary: Accept-Encoding\r\n' in head
+        head, _ = self._get('/script.js',
+                            'If-None-Match: ' + gzip_etag.decode())
+        assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+
+    def test_revalidate_without_compressing(self):
+        head, _ = self._get('/script.js', 'Accept-Encoding: gzip')
+        etag = head.split(b'Etag: ', 1)[1].split(b'\r\n')[0].decode()
+        self.httpprotocol._compressed_cache.clear()
+
+        with mock.patch('httpserver.httpserver.gzip_compress') as compress:
+            head, _ = self._get('/script.js', 'Accept-Encoding: gzip',
+                                'If-None-Match: ' + etag)
+        assert head.startswith(b'HTTP/1.1 304 Not Modified\r\n')
+        assert not compress.called
+
+    def test_revalidate_single_stat(self):
+        self._get('/script.js', 'Accept-Encoding: gzip, br')
+        with mock.patch('os.stat', wraps=os.stat) as stat:
+            self._get('/script.js', 'Accept-Encoding: gzip, br')
+        assert stat.call_count == 1
+
+    def test_precompressed(self):
+        head, body = self._get('/style.css', 'Accept-Encoding: gzip')
+        assert b'Content-Encoding: gzip\r\n' in head
+        assert b'Content-Type: text/css\r\n' in head
+        assert body == b'precompressed'
+
+    def test_not_smaller_cached(self):
+        self._write('random.txt', os.urandom(1000))
+        with mock.patch('httpserver.httpserver.gzip_compress',
+                        wraps=gzip_compress) as compress:
+            for _ in range(2):
+                head, _ = self._get('/random.txt', 'Accept-Encoding: gzip')
+                assert b'Content-Encoding' not in head
+        assert compress.call_count == 1
+
+        # until the file changes
+        self._write('random.txt', b'a' * 2000)
+        head, _ = self._get('/random.txt', 'Accept-Encoding: gzip')
+        assert b'Content-Encoding: gzip\r\n' in head
+
+    def test_not_compressible(self):
+        head, body = self._get('/image.png', 'Accept-Encoding: gzip')
+        assert b'Content-Encoding' not in head
+        assert b'Vary' not in head
+
+    def test_compression_disabled(self):
+        self.httpprotocol._compress_max_size = 0
+        head, body = self._get('/script.js', 'Accept-Encoding: gzip')
+        assert b'Content-Encoding' not in head
+        assert body == self.script
+
+    def test_warm(self):
+        self._write('index.html', b'<html></html>')
+        manifest = Manifest()
+        manifest.scan([self.folder])
+        protocol = HttpProtocol('localhost', self.folder,
+                                event_loop=mock.Mock(), manifest=manifest)
+        protocol.connection_made(self.transport)
+        self.httpprotocol = protocol
+        # The precompressed style.css.gz isn't loaded by itself
+        assert protocol.warm() == 4
+        assert len(protocol._compressed_cache) > 0
+        misses = protocol._cache.misses, protocol._compressed_cache.misses
+
+        head, body = self._get('/script.js', 'Accept-Encoding: gzip')
+        assert gzip.decompress(body) == self.script
+        head, body = self._get('/', 'Accept-Encoding: gzip')
+        assert b'Content-Type: text/html\r\n' in head
+        assert (protocol._cache.misses,
+                protocol._compressed_cache.misses) == misses
+
+    def test_etag_from_manifest(self):
+        manifest = Manifest('sha1')
+        manifest.scan([self.folder])
+        filename = os.path.join(self.folder, 'script.js')
+        key = manifest.files[filename][0]
+        manifest.files[filename] = (key, 'fromthemanifest', 'text/plain')
+        protocol = HttpProtocol('localhost', self.folder, etag='sha1',
+                                event_loop=mock.Mock(), manifest=manifest)
+        protocol.connection_made(self.transport)
+        self.httpprotocol = protocol
+        head, _ = self._get('/script.js')
+        assert b'Etag: "fromthemanifest"\r\n' in head
+
+        # Unless the file changed
+        self._write('script.js', b'changed')
+        head, _ = self._get('/script.js')
+        assert b'fromthemanifest' not in head
+
+
+class TestHttpserverSendfile(unittest.TestCase):
+    """Test sending files from disk with a real event loop"""
+
+    def setUp(self):
+        self.fixtures_location = os.path.join(
+            os.path.dirname(__file__), 'fixtures')
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _read_fixture(self, filename):
+        filename = os.path.join(self.fixtures_location, filename)
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_send_file_fallback(self):
+        """Transports without sendfile get the file in chunks"""
+        protocol = HttpProtocol('localhost', self.fixtures_location,
+                                event_loop=self.loop, sendfile_threshold=0)
+        transport = mock.MagicMock(spec=['write', 'close', 'is_closing'])
+        transport.is_closing.return_value = False
+        protocol.connection_made(transport)
+
+        protocol.data_received(self._read_fixture('get_index_named.crlf'))
+        # The file is still being sent, so the connection stays open
+        assert not transport.close.called
+        self.loop.run_until_complete(protocol._sending)
+
+        response = b''.join(c[0][0] for c in transport.write.call_args_list)
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert body == self._read_fixture('index.html')
+        assert 'Content-Length: {}'.format(len(body)).encode() in head
+        assert transport.close.called
+
+    def test_send_file_mmap(self):
+        """Mapped files are sent as views of a shared mapping"""
+        mmap_cache = FileCache()
+        for _ in range(2):
+            protocol = HttpProtocol('localhost', self.fixtures_location,
+                                    event_loop=self.loop, sendfile_threshold=0,
+                                    mmap_cache=mmap_cache)
+            transport = mock.MagicMock(spec=['write', 'close', 'is_closing'])
+            transport.is_closing.return_value = False
+            protocol.connection_made(transport)
+
+            protocol.data_received(self._read_fixture('get_index_named.crlf'))
+            self.loop.run_until_complete(protocol._sending)
+
+            chunks = [c[0][0] for c in transport.write.call_args_list]
+            assert isinstance(chunks[-1], memoryview)
+            assert b''.join(chunks).endswith(
+                b'\r\n\r\n' + self._read_fixture('index.html'))
+        assert (mmap_cache.hits, mmap_cache.misses) == (1, 1)
+
+    def test_send_file_flow_control(self):
+        """No more of the file is read while the transport is paused"""
+        protocol = HttpProtocol('localhost', self.fixtures_location,
+                                event_loop=self.loop, sendfile_threshold=0)
+        transport = mock.MagicMock(spec=['write', 'close', 'is_closing',
+                                         'pause_reading', 'resume_reading'])
+        transport.is_closing.return_value = False
+        transport.write.side_effect = lambda data: protocol.pause_writing()
+        protocol.connection_made(transport)
+
+        with mock.patch('httpserver.httpserver.CHUNK_SIZE', 16):
+            protocol.data_received(self._read_fixture('get_index_named.crlf'))
+            for _ in range(10):
+                self.loop.run_until_complete(asyncio.sleep(0))
+            # the head and one chunk
+            assert transport.write.call_count == 2
+
+            transport.write.side_effect = None
+            protocol.resume_writing()
+            self.loop.run_until_complete(protocol._sending)
+
+        response = b''.join(c[0][0] for c in transport.write.call_args_list)
+        assert response.endswith(b'\r\n\r\n' +
+                                 self._read_fixture('index.html'))
+
+    def _stream(self, version):
+        """Send a streamed response and return what was written"""
+        async def chunks():
+            for chunk in (b'hello', b'', b' world'):
+                yield chunk
+
+        protocol = HttpProtocol('localhost', self.fixtures_location,
+                                event_loop=self.loop)
+        transport = mock.MagicMock(spec=['write', 'close', 'is_closing'])
+        protocol.connection_made(transport)
+        protocol._write_response(Response(
+            version=version, headers={'Keep-Alive': 'timeout=15'},
+            stream=chunks()))
+        # Responses after a close-delimited body are dropped
+        protocol._write_response(Response(version=version, body=b''))
+        self.loop.run_until_complete(protocol._sending)
+        return transport
+
+    def test_stream_chunked(self):
+        transport = self._stream('HTTP/1.1')
+        head, body, rest = b''.join(
+            c[0][0] for c in transport.write.call_args_list).split(
+                b'\r\n\r\n', 2)
+        assert b'Transfer-Encoding: chunked\r\n' in head
+        assert b'Content-Length' not in head
+        assert body == b'5\r\nhello\r\n6\r\n world\r\n0'
+        assert rest.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert not transport.close.called
+
+    def test_stream_close_delimited(self):
+        transport = self._stream('HTTP/1.0')
+        head, body = b''.join(
+            c[0][0] for c in transport.write.call_args_list).split(
+                b'\r\n\r\n', 1)
+        assert b'Connection: close\r\n' in head
+        assert b'Keep-Alive' not in head
+        assert b'Transfer-Encoding' not in head
+        assert body == b'hello world'
+        assert transport.close.called
+
+    def test_send_file_range(self):
+        """Only the requested part of a file is sent"""
+        protocol = HttpProtocol('localhost', self.fixtures_location,
+                                event_loop=self.loop, sendfile_threshold=0)
+        transport = mock.MagicMock(spec=['write', 'close', 'is_closing'])
+        transport.is_closing.return_value = False
+        protocol.connection_made(transport)
+
+        protocol.data_received(b'GET /index.html HTTP/1.1\r\n'
+                               b'Range: bytes=-10\r\n\r\n')
+        self.loop.run_until_complete(protocol._sending)
+
+        response = b''.join(c[0][0] for c in transport.write.call_args_list)
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 206 Partial Content\r\n')
+        assert b'Content-Length: 10\r\n' in head
+        assert body == self._read_fixture('index.html')[-10:]
+
+    def test_send_file_socket(self):
+        """Files are sent over a real socket"""
+        server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: HttpProtocol('localhost', self.fixtures_location,
+                                 event_loop=self.loop, sendfile_threshold=0),
+            '127.0.0.1', 0))
+        port = server.sockets[0].getsockname()[1]
+
+        async def fetch():
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(self._read_fixture('get_index_persistent.crlf') +
+                         self._read_fixture('get_index_named.crlf'))
+            response = await reader.read()
+            writer.close()
+            return response
+
+        response = self.loop.run_until_complete(fetch())
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+
+        index = self._read_fixture('index.html')
+        assert response.count(b'HTTP/1.1 200 OK\r\n') == 2
+        assert response.endswith(b'\r\n\r\n' + index)
+
+
+class TestHttpserverExecutor(unittest.TestCase):
+    """Test reading files in an executor"""
+
+    def setUp(self):
+        self.fixtures_location = os.path.join(
+            os.path.dirname(__file__), 'fixtures')
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        executor = concurrent.futures.ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        self.protocol = HttpProtocol('localhost', self.fixtures_location,
+                                     event_loop=self.loop, executor=executor)
+        self.transport = mock.MagicMock(
+            spec=['write', 'close', 'is_closing'])
+        self.protocol.connection_made(self.transport)
+
+    def _read_fixture(self, filename):
+        filename = os.path.join(self.fixtures_location, filename)
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def _sent(self):
+        return b''.join(c[0][0] for c in self.transport.write.call_args_list)
+
+    def _wait(self):
+        """Wait until all queued responses are done"""
+        futures = [response for response in self.protocol._outgoing
+                   if asyncio.isfuture(response)]
+        if futures:
+            self.loop.run_until_complete(asyncio.wait(futures))
+
+    def test_executor(self):
+        """Files that aren't cached are read in the executor"""
+        self.protocol.data_received(
+            self._read_fixture('get_index_named.crlf'))
+        assert not self.transport.write.called
+        self._wait()
+
+        response = self._sent()
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert response.endswith(self._read_fixture('index.html'))
+        assert self.transport.close.called
+
+    def test_head(self):
+        """Responses to HEAD from the executor have no body"""
+        self.protocol._etag = 'sha1'
+        self.protocol.data_received(
+            b'HEAD / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'HEAD /nothing HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        self._wait()
+        first, second = self._sent().split(b'\r\n\r\n')[:2]
+        assert first.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert second.startswith(b'HTTP/1.1 404 Not Found\r\n')
+        assert not self.protocol._heads
+
+    def test_cached_on_loop(self):
+        """Files cached in memory are served without the executor"""
+        request = self._read_fixture('get_index_persistent.crlf')
+        self.protocol.data_received(request)
+        self._wait()
+        self.transport.write.reset_mock()
+
+        self.protocol.data_received(request)
+        assert not self.protocol._outgoing
+        assert self._sent().startswith(b'HTTP/1.1 200 OK\r\n')
+
+    def test_executor_order(self):
+        """Responses are written in order if the executor is slow"""
+        release = threading.Event()
+        # Runs before the executor is shut down
+        self.addCleanup(release.set)
+        get_file_response = self.protocol._get_file_response
+
+        def slow_get_file_response(request, response, filename, entry,
+                                   cached_only=False):
+            if filename.endswith('index.html') and not cached_only:
+                release.wait()
+            return get_file_response(request, response, filename, entry,
+                                     cached_only)
+
+        self.protocol._get_file_response = slow_get_file_response
+        self.protocol.data_received(
+            self._read_fixture('get_index_persistent.crlf') +
+            self._read_fixture(
+                'no_index_dir/get_directory_without_index.crlf'))
+        self.loop.run_until_complete(
+            asyncio.wait([self.protocol._outgoing[1]]))
+        assert not self.transport.write.called
+
+        release.set()
+        self._wait()
+        response = self._sent()
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert response.index(b'200 OK') < response.index(b'404 Not Found')
+        assert self.transport.close.called
+
 
 if __name__ == '__main__':
     unittest.main()
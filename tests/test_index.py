@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_index
+----------------------------------
+
+Tests for `httpserver.index` module.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from httpserver.index import PathIndex
+
+
+class TestPathIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name in ['index.html', 'a.txt', 'sub/index.html', 'sub/b.txt',
+                     'empty/c.txt']:
+            filename = os.path.join(self.folder, name)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'wb') as f:
+                f.write(b'content')
+        self.index = PathIndex(self.folder)
+        self.index.scan()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _path(self, name):
+        return os.path.join(self.folder, *name.split('/'))
+
+    def test_files(self):
+        assert self.index.get('/a.txt') == self._path('a.txt')
+        assert self.index.get('sub/b.txt') == self._path('sub/b.txt')
+        assert self.index.get('/sub/../empty/c.txt') == self._path(
+            'empty/c.txt')
+        assert self.index.get('/missing.txt') is None
+
+    def test_directories(self):
+        assert self.index.get('/') == self._path('index.html')
+        assert self.index.get('') == self._path('index.html')
+        assert self.index.get('/sub/') == self._path('sub/index.html')
+        assert self.index.get('/sub') == self._path('sub/index.html')
+        assert self.index.get('/empty/') is None
+
+    def test_outside_folder(self):
+        name = os.path.basename(self.folder)
+        assert self.index.get('/../{}/a.txt'.format(name)) is None
+
+    def test_no_file_system_access(self):
+        with mock.patch('os.stat') as stat:
+            self.index.get('/a.txt')
+        assert not stat.called
+
+    def test_rescan(self):
+        os.unlink(self._path('a.txt'))
+        assert self.index.get('/a.txt') is not None
+        self.index.scan()
+        assert self.index.get('/a.txt') is None
+        assert len(self.index) == 6
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_loops
+----------------------------------
+
+Tests for `httpserver.loops` module.
+"""
+import unittest
+from unittest import mock
+
+from httpserver.loops import install, resolve
+
+
+class TestLoops(unittest.TestCase):
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            resolve('twisted')
+
+    def test_asyncio(self):
+        with mock.patch('asyncio.set_event_loop_policy') as set_policy:
+            assert install('asyncio') == 'asyncio'
+        assert not set_policy.called
+
+    def test_fallback(self):
+        """Without uvloop the asyncio loop is used"""
+        with mock.patch.dict('sys.modules', {'uvloop': None}), \
+                mock.patch('asyncio.set_event_loop_policy') as set_policy:
+            assert install('auto') == 'asyncio'
+            with self.assertLogs('httpserver.loops', 'WARNING'):
+                assert install('uvloop') == 'asyncio'
+        assert not set_policy.called
+
+    def test_uvloop(self):
+        uvloop = mock.Mock()
+        with mock.patch.dict('sys.modules', {'uvloop': uvloop}), \
+                mock.patch('asyncio.set_event_loop_policy') as set_policy:
+            assert install('auto') == 'uvloop'
+        set_policy.assert_called_once_with(uvloop.EventLoopPolicy())
+
+
+if __name__ == '__main__':
+    unittest.main()
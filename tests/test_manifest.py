@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_manifest
+----------------------------------
+
+Tests for `httpserver.manifest` module.
+"""
+import concurrent.futures
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from httpserver.cache import stat_etag
+from httpserver.manifest import Manifest
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.folder, 'sub'))
+        self._write('index.html', b'<html></html>')
+        self._write('sub/script.js', b'hello();')
+        self.path = os.path.join(self.folder, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.folder, name), 'wb') as f:
+            f.write(content)
+
+    def test_scan(self):
+        manifest = Manifest()
+        assert manifest.scan([self.folder]) == 0
+        assert len(manifest) == 2
+        filename = os.path.join(self.folder, 'sub', 'script.js')
+        stat = os.stat(filename)
+        key = manifest.files[filename][0]
+        assert manifest.get(filename, key) == (
+            stat_etag(stat), mimetypes.guess_type(filename)[0])
+        assert manifest.get(filename, (0, 0, 0)) is None
+
+    def test_sha1(self):
+        manifest = Manifest('sha1')
+        assert manifest.scan([self.folder]) == 2
+        filename = os.path.join(self.folder, 'index.html')
+        assert manifest.files[filename][1] == hashlib.sha1(
+            b'<html></html>').hexdigest()
+
+    def test_executor(self):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            manifest = Manifest('sha1')
+            assert manifest.scan([self.folder], executor=executor) == 2
+        filename = os.path.join(self.folder, 'sub', 'script.js')
+        assert manifest.files[filename][1] == hashlib.sha1(
+            b'hello();').hexdigest()
+
+    def test_unchanged_not_hashed(self):
+        previous = Manifest('sha1')
+        previous.scan([self.folder])
+        self._write('sub/script.js', b'changed();')
+        manifest = Manifest('sha1')
+        with mock.patch('httpserver.manifest.sha1_file',
+                        return_value='hash') as sha1_file:
+            assert manifest.scan([self.folder], previous) == 1
+        sha1_file.assert_called_once_with(
+            os.path.join(self.folder, 'sub', 'script.js'))
+
+    def test_other_strategy_not_reused(self):
+        previous = Manifest('stat')
+        previous.scan([self.folder])
+        manifest = Manifest('sha1')
+        assert manifest.scan([self.folder], previous) == 2
+
+    def test_save_load(self):
+        manifest = Manifest('sha1')
+        manifest.scan([self.folder])
+        manifest.save(self.path)
+        loaded = Manifest.load(self.path, 'sha1')
+        assert loaded.etag == 'sha1'
+        assert loaded.files == manifest.files
+        assert os.listdir(self.folder).count('manifest.json') == 1
+
+    def test_load_missing(self):
+        manifest = Manifest.load(self.path, 'sha1')
+        assert len(manifest) == 0
+        assert manifest.etag == 'sha1'
+
+    def test_load_invalid(self):
+        for content in [b'not json', b'{"version": 0}', b'{"version": 1}']:
+            self._write('manifest.json', content)
+            with self.assertLogs('httpserver.manifest', 'WARNING'):
+                manifest = Manifest.load(self.path)
+            assert len(manifest) == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_messages
+----------------------------------
+
+Tests for `httpserver.messages` module.
+"""
+import unittest
+
+from httpserver.messages import Headers, Request, Response
+
+
+class TestHeaders(unittest.TestCase):
+
+    def setUp(self):
+        self.headers = Headers()
+        self.headers.add(b'Host', b'localhost')
+        self.headers.add(b'Cache-Control', b'no-cache')
+        self.headers.add(b'cache-control', b'no-store')
+
+    def test_case_insensitive(self):
+        assert self.headers.get('host') == 'localhost'
+        assert self.headers.get('HOST') == 'localhost'
+        assert 'cache-CONTROL' in self.headers
+        assert 'Accept' not in self.headers
+        assert self.headers.get('Accept', '') == ''
+
+    def test_multiple(self):
+        assert self.headers.get('Cache-Control') == 'no-cache, no-store'
+        assert self.headers.get_all('Cache-Control') == ['no-cache',
+                                                         'no-store']
+        assert self.headers.get_all('Accept') == []
+        assert len(self.headers) == 2
+
+    def test_items(self):
+        assert self.headers.items() == [
+            ('host', 'localhost'), ('cache-control', 'no-cache, no-store')]
+
+    def test_latin1(self):
+        """Values are decoded as ISO-8859-1, which never fails"""
+        self.headers.add(b'User-Agent', b'caf\xe9')
+        assert self.headers.get('User-Agent') == 'caf\xe9'
+
+
+class TestMessages(unittest.TestCase):
+
+    def test_slots(self):
+        request = Request('GET', '/', 'HTTP/1.1')
+        response = Response()
+        for message in (request, response, request.headers):
+            with self.assertRaises(AttributeError):
+                message.anything = 1
+
+    def test_response_defaults(self):
+        response = Response(code=304)
+        assert response.version == 'HTTP/1.1'
+        assert response.headers == {}
+        assert response.body is None
+        assert response.file is None
+        assert response.stream is None
+        # Every response gets its own headers
+        assert Response().headers is not Response().headers
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `httpserver.metrics` module.
+"""
+import unittest
+
+from httpserver.metrics import Histogram, Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        assert histogram.render('t') == [
+            't_bucket{le="0.1"} 2',
+            't_bucket{le="1.0"} 3',
+            't_bucket{le="+Inf"} 4',
+            't_sum 2.65',
+            't_count 4',
+        ]
+
+    def test_render(self):
+        metrics = Metrics()
+        metrics.bytes_sent = 100
+        metrics.observe('write', 0.002)
+        text = metrics.render([('extra', 'gauge', 'Something', 3)])
+        lines = text.splitlines()
+        assert '# TYPE httpserver_sent_bytes_total counter' in lines
+        assert 'httpserver_sent_bytes_total 100' in lines
+        assert '# HELP httpserver_extra Something' in lines
+        assert 'httpserver_extra 3' in lines
+        assert '# TYPE httpserver_write_seconds histogram' in lines
+        assert 'httpserver_write_seconds_bucket{le="0.0025"} 1' in lines
+        assert 'httpserver_write_seconds_count 1' in lines
+        assert text.endswith('\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
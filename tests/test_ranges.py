@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_ranges
+----------------------------------
+
+Tests for `httpserver.ranges` module.
+"""
+import unittest
+
+from httpserver.ranges import (MAX_RANGES, parse_range, range_segments,
+                               segments_length)
+
+
+class TestRanges(unittest.TestCase):
+
+    def test_parse_range(self):
+        assert parse_range('bytes=0-0', 10) == [(0, 0)]
+        assert parse_range('bytes=2-', 10) == [(2, 9)]
+        assert parse_range('bytes=5-100', 10) == [(5, 9)]
+        assert parse_range('bytes=-3', 10) == [(7, 9)]
+        assert parse_range('bytes=-30', 10) == [(0, 9)]
+        assert parse_range('bytes = 1-2 , 4-5', 10) == [(1, 2), (4, 5)]
+
+    def test_unsatisfiable(self):
+        assert parse_range('bytes=10-', 10) == []
+        assert parse_range('bytes=-0', 10) == []
+        assert parse_range('bytes=0-', 0) == []
+        assert parse_range('bytes=10-20, 30-', 10) == []
+
+    def test_invalid(self):
+        for header in ['bytes=5-3', 'bytes=a-b', 'bytes=5', 'bytes=--1',
+                       'items=0-1', 'bytes=' + ','.join(
+                           '{0}-{0}'.format(2 * i)
+                           for i in range(MAX_RANGES + 1))]:
+            assert parse_range(header, 100) is None, header
+
+    def test_merge(self):
+        assert parse_range('bytes=0-4, 5-9', 10) == [(0, 9)]
+        assert parse_range('bytes=6-8, 0-2, 1-3', 10) == [(0, 3), (6, 8)]
+        assert parse_range('bytes=0-9, 2-3, -2', 10) == [(0, 9)]
+        # Many overlapping ranges are merged before they are counted
+        header = 'bytes=' + ','.join(['0-0'] * (MAX_RANGES + 1))
+        assert parse_range(header, 10) == [(0, 0)]
+
+    def test_multipart_segments(self):
+        headers, segments = range_segments([(0, 1), (5, 9)], 10, 'text/html')
+        boundary = headers['Content-Type'].split('boundary=')[1]
+        assert headers['Content-Type'].startswith('multipart/byteranges;')
+        assert segments[0].startswith('--{}\r\n'.format(boundary).encode())
+        assert b'Content-Range: bytes 0-1/10\r\n' in segments[0]
+        assert segments[1] == (0, 2)
+        assert segments[4] == (5, 5)
+        assert segments[-1] == '--{}--\r\n'.format(boundary).encode()
+        assert segments_length(segments) == sum(
+            len(s) for s in segments if isinstance(s, bytes)) + 7
+
+
+if __name__ == '__main__':
+    unittest.main()
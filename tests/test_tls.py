@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_tls
+----------------------------------
+
+Tests for `httpserver.tls` module.
+"""
+import asyncio
+import os
+import socket
+import ssl
+import unittest
+
+from httpserver.httpserver import HttpProtocol
+from httpserver.metrics import Metrics
+from httpserver.tls import Certificates, create_context
+
+CERTS = os.path.join(os.path.dirname(__file__), 'certs')
+
+
+def _cert(name):
+    """Get the certificate and key files of a test certificate"""
+    return (os.path.join(CERTS, name + '.pem'),
+            os.path.join(CERTS, name + '.key'))
+
+
+class TestCreateContext(unittest.TestCase):
+
+    def test_context(self):
+        context = create_context(*_cert('localhost'))
+        assert context.minimum_version == ssl.TLSVersion.TLSv1_2
+        assert not context.options & ssl.OP_NO_TICKET
+        assert context.options & ssl.OP_NO_COMPRESSION
+
+    def test_missing_key(self):
+        with self.assertRaises(ssl.SSLError):
+            create_context(_cert('localhost')[0])
+
+
+class TestTLS(unittest.TestCase):
+    """Serve over TLS with a real event loop"""
+
+    def setUp(self):
+        self.fixtures_location = os.path.join(
+            os.path.dirname(__file__), 'fixtures')
+        self.loop = asyncio.new_event_loop()
+        self.metrics = Metrics()
+        self.certificates = Certificates(*_cert('localhost'))
+        self.certificates.add('*.example.org', *_cert('example.org'))
+        self.certificates.add('example.org', *_cert('example.org'))
+        self.server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: HttpProtocol('localhost', self.fixtures_location,
+                                 event_loop=self.loop, metrics=self.metrics,
+                                 certificates=self.certificates),
+            '127.0.0.1', 0, ssl=self.certificates.context))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.client = ssl.create_default_context()
+        for name in ('localhost', 'example.org'):
+            self.client.load_verify_locations(_cert(name)[0])
+        self.client.set_alpn_protocols(['h2', 'http/1.1'])
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def _get(self, server_hostname='localhost'):
+        """Request the index, returns the response and the SSL object"""
+        async def get():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port, ssl=self.client,
+                server_hostname=server_hostname, ssl_handshake_timeout=5)
+            ssl_object = writer.get_extra_info('ssl_object')
+            writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+                         b'Connection: close\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            return response, ssl_object
+        return self.loop.run_until_complete(
+            asyncio.wait_for(get(), 10))
+
+    def test_get(self):
+        response, ssl_object = self._get()
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert ssl_object.selected_alpn_protocol() == 'http/1.1'
+        assert self.metrics.handshakes == 1
+        assert self.metrics.histograms['handshake'].count == 1
+
+    def test_sni(self):
+        for server_hostname, expected in [('localhost', 'localhost'),
+                                          ('example.org', 'example.org'),
+                                          ('www.example.org', None)]:
+            if expected is None:
+                # Matches the wildcard, but the certificate doesn't
+                with self.assertRaises(ssl.SSLCertVerificationError):
+                    self._get(server_hostname)
+                continue
+            _, ssl_object = self._get(server_hostname)
+            subject = dict(item[0] for item in
+                           ssl_object.getpeercert()['subject'])
+            assert subject['commonName'] == expected
+
+    def _connect(self, session=None):
+        """Request the index, returns the session and if it was resumed"""
+        # asyncio can't resume sessions, so a blocking socket is used in a
+        # thread while the server runs on the loop
+        def handshake():
+            with socket.create_connection(('127.0.0.1', self.port)) as sock:
+                with self.client.wrap_socket(
+                        sock, server_hostname='localhost',
+                        session=session) as tls:
+                    tls.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+                                b'Connection: close\r\n\r\n')
+                    while tls.recv(4096):
+                        pass
+                    return tls.session, tls.session_reused
+        return self.loop.run_until_complete(
+            self.loop.run_in_executor(None, handshake))
+
+    def test_resume(self):
+        """A client that kept its session doesn't do a full handshake"""
+        for version in (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3):
+            self.client.maximum_version = version
+            session, reused = self._connect()
+            assert not reused
+            _, reused = self._connect(session)
+            assert reused
+        assert self.metrics.handshakes == 4
+        assert self.metrics.resumed_handshakes == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
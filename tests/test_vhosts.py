@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_vhosts
+----------------------------------
+
+Tests for `httpserver.vhosts` module.
+"""
+import unittest
+
+from httpserver.vhosts import HostTable, VirtualHost
+
+
+class TestHostTable(unittest.TestCase):
+
+    def setUp(self):
+        self.example = VirtualHost('/srv/example')
+        self.wildcard = VirtualHost('/srv/wildcard')
+        self.deep = VirtualHost('/srv/deep')
+        self.hosts = HostTable()
+        self.hosts.add('example.com', self.example)
+        self.hosts.add('*.example.com', self.wildcard)
+        self.hosts.add('*.static.example.com', self.deep)
+
+    def test_exact(self):
+        assert self.hosts.get('example.com') is self.example
+        assert self.hosts.get('Example.COM.') is self.example
+        assert len(self.hosts) == 3
+
+    def test_wildcard(self):
+        assert self.hosts.get('www.example.com') is self.wildcard
+        assert self.hosts.get('a.b.example.com') is self.wildcard
+        # the longest wildcard wins
+        assert self.hosts.get('img.static.example.com') is self.deep
+        assert self.hosts.get('static.example.com') is self.wildcard
+
+    def test_exact_beats_wildcard(self):
+        www = VirtualHost('/srv/www')
+        self.hosts.add('www.example.com', www)
+        assert self.hosts.get('www.example.com') is www
+        assert self.hosts.get('ftp.example.com') is self.wildcard
+
+    def test_unknown(self):
+        assert self.hosts.get('example.org') is None
+        assert self.hosts.get('notexample.com') is None
+        self.hosts.default = self.example
+        assert self.hosts.get('example.org') is self.example
+        assert self.hosts.get(None) is self.example
+
+    def test_remembered(self):
+        """Wildcard matches are remembered, but not without bound"""
+        self.hosts.MAX_REMEMBERED = 2
+        for name in ['a.example.com', 'b.example.com', 'c.example.com']:
+            assert self.hosts.get(name) is self.wildcard
+        assert len(self.hosts._remembered) == 2
+        assert self.hosts.get('c.example.com') is self.wildcard
+
+        # Adding a host forgets the matches, they may have changed
+        a = VirtualHost('/srv/a')
+        self.hosts.add('a.example.com', a)
+        assert self.hosts.get('a.example.com') is a
+
+
+if __name__ == '__main__':
+    unittest.main()
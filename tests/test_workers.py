@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_workers
+----------------------------------
+
+Tests for `httpserver.workers` module.
+"""
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+import unittest
+from unittest import mock
+
+from httpserver.workers import Supervisor
+
+_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.port = _free_port()
+        self.process = subprocess.Popen(
+            [sys.executable, '-u', '-c',
+             'from httpserver import _start_server; '
+             '_start_server("127.0.0.1", {}, "localhost", {!r}, '
+             'workers=2)'.format(self.port, _dir)],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        assert self.process.stdout.readline().startswith('Starting 2 workers')
+        self.pids = [self._started() for _ in range(2)]
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            # the supervisor passes this on to the workers
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:  # pragma: no cover
+                self.process.kill()
+                self.process.wait()
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.process.stdout.close()
+
+    def _started(self):
+        """Wait for a worker to start and return its pid"""
+        line = self.process.stdout.readline()
+        return int(re.search(r'\(pid (\d+)\)', line).group(1))
+
+    def _get(self):
+        with socket.create_connection(('127.0.0.1', self.port)) as sock:
+            sock.sendall(b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+            return b''.join(iter(lambda: sock.recv(4096), b''))
+
+    def test_serve(self):
+        for _ in range(4):
+            assert self._get().startswith(b'HTTP/1.1 200 OK\r\n')
+
+    def test_restart_worker(self):
+        os.kill(self.pids[0], signal.SIGKILL)
+        pid = self._started()
+        assert pid not in self.pids
+        self.pids.append(pid)
+        assert self._get().startswith(b'HTTP/1.1 200 OK\r\n')
+
+    def _wait_gone(self, pid):
+        """Wait for a worker to exit"""
+        for _ in range(50):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def test_reload(self):
+        old = list(self.pids)
+        self.process.send_signal(signal.SIGHUP)
+        new = [self._started() for _ in range(2)]
+        self.pids.extend(new)
+        assert not set(new) & set(old)
+        for pid in old:
+            assert self._wait_gone(pid)
+        assert self._get().startswith(b'HTTP/1.1 200 OK\r\n')
+
+    def test_drain(self):
+        """Idle keep-alive connections are closed on SIGTERM"""
+        with socket.create_connection(('127.0.0.1', self.port)) as sock:
+            sock.sendall(b'GET / HTTP/1.1\r\n\r\n')
+            assert sock.recv(4096).startswith(b'HTTP/1.1 200 OK\r\n')
+            self.process.send_signal(signal.SIGTERM)
+            sock.settimeout(5)
+            assert sock.recv(4096) == b''
+        assert self.process.wait(timeout=5) == 0
+
+    def test_terminate(self):
+        self.process.send_signal(signal.SIGTERM)
+        assert self.process.wait(timeout=5) == 0
+        for pid in self.pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def test_give_up(self):
+        """Workers that can't start aren't restarted forever"""
+        with mock.patch('os.fork', return_value=1234), \
+                mock.patch('os.wait', return_value=(1234, 1 << 8)), \
+                mock.patch('time.sleep') as sleep, \
+                mock.patch('signal.signal'), \
+                mock.patch('os.kill'):
+            supervisor = Supervisor(1, None)
+            assert not supervisor.run()
+        assert [c[0][0] for c in sleep.call_args_list] == [1, 2, 4, 8]
+
+
+if __name__ == '__main__':
+    unittest.main()